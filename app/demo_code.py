@@ -1,7 +1,6 @@
 # code.py
 import os, wifi
 
-from time import sleep
 
 
 print("SSID: " + os.getenv('CIRCUITPY_WIFI_SSID') )
@@ -13,18 +12,15 @@ print("connecting... or maybe already connected....")
 print("my IP addr:", wifi.radio.ipv4_address)
 
 print("Scanning wifi...")
-sleep(1)
 networks = []
-for network in wifi.radio.start_scanning_networks():
+for network in wifi.radio.start_scanning_networks():    # results arrive as the radio finds them
     networks.append(network)
-    print(f"{len(networks)} network(s)")
-    sleep(1)
-    
+print(f"{len(networks)} network(s)")
+
 wifi.radio.stop_scanning_networks()
 networks = sorted(networks, key=lambda net: net.rssi, reverse=True)
 for network in networks:
-    print("ssid:",network.ssid, "rssi:",network.rssi)
-    sleep(1)
+    print("ssid:",network.ssid, "rssi:",network.rssi, "channel:",network.channel)
 
 import adafruit_connection_manager
 import adafruit_requests
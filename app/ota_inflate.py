@@ -0,0 +1,95 @@
+# zlib/gzip decoding, loaded only when OTAUpdater(compressed=True) or a
+# compressed bundle calls for it
+
+import io
+
+from .ota_updater import DOWNLOAD_CHUNK_SIZE
+
+
+class _ChunkStream(getattr(io, 'IOBase', object)):
+    """Readable stream over an iterator of chunks, for the pull-style inflaters."""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.pending = memoryview(b'')
+
+    def readinto(self, buf):
+        if not len(self.pending):
+            self.pending = memoryview(next(self.chunks, b''))
+        n = min(len(buf), len(self.pending))
+        buf[:n] = self.pending[:n]
+        self.pending = self.pending[n:]
+        return n
+
+    def read(self, size=-1):
+        buf = bytearray(size if size > 0 else DOWNLOAD_CHUNK_SIZE)
+        return bytes(buf[:self.readinto(buf)])
+
+
+class _Inflater:
+    """
+    Incremental zlib or gzip decompression of data arriving in chunks, using whichever
+    streaming API the firmware has: zlib.decompressobj (CPython), deflate.DeflateIO
+    (newer MicroPython) or zlib.DecompIO (older MicroPython). Output comes in pieces no
+    larger than the buffer given; the only other memory is the 2**wbits byte window.
+    CircuitPython has none of them (its zlib only has one-shot decompress()), so there
+    available() is False and nothing is downloaded compressed.
+    """
+
+    @staticmethod
+    def available() -> bool:
+        try:
+            import zlib
+            if hasattr(zlib, 'decompressobj') or hasattr(zlib, 'DecompIO'):
+                return True
+        except ImportError:
+            pass
+        try:
+            import deflate
+            return hasattr(deflate, 'DeflateIO')
+        except ImportError:
+            return False
+
+    def __init__(self, chunks, gzip=False):
+        self.chunks = chunks
+        self.gzip = gzip
+
+    def pieces(self, buf):
+        chunks = iter(self.chunks)
+        first = next(chunks, b'')
+        # a zlib header names its window size; gzip does not, so assume the largest
+        wbits = 15 if self.gzip or not first else (first[0] >> 4) + 8
+
+        def all_chunks():
+            yield first
+            yield from chunks
+
+        try:
+            import zlib
+        except ImportError:
+            zlib = None
+        if zlib is not None and hasattr(zlib, 'decompressobj'):
+            inflater = zlib.decompressobj(wbits + (16 if self.gzip else 0))
+            for chunk in all_chunks():
+                while chunk:
+                    out = inflater.decompress(chunk, len(buf))
+                    if out:
+                        yield out
+                    chunk = inflater.unconsumed_tail
+            out = inflater.flush()
+            if out:
+                yield out
+            return
+
+        stream = _ChunkStream(all_chunks())
+        try:
+            import deflate
+            inflater = deflate.DeflateIO(stream, deflate.GZIP if self.gzip else deflate.ZLIB, wbits)
+        except (ImportError, AttributeError):
+            inflater = zlib.DecompIO(stream, wbits + (16 if self.gzip else 0))
+        view = memoryview(buf)
+        while True:
+            n = inflater.readinto(buf)
+            if not n:
+                return
+            yield view[:n]
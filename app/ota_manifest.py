@@ -0,0 +1,89 @@
+# The .manifest.json tools/build_release.py puts in releases and its HMAC
+# signature, for OTAUpdater(verify=..., manifest_key=...)
+
+import binascii
+import hashlib
+
+from .ota_updater import _log, DOWNLOAD_CHUNK_SIZE
+
+
+def _hmac_sha256(key, data):    # hex; CircuitPython has no hmac module
+    if len(key) > 64:
+        key = hashlib.new('sha256', key).digest()
+    key = key + b'\0' * (64 - len(key))
+    inner = hashlib.new('sha256', bytes(b ^ 0x36 for b in key))
+    inner.update(data)
+    outer = hashlib.new('sha256', bytes(b ^ 0x5C for b in key))
+    outer.update(inner.digest())
+    return binascii.hexlify(outer.digest()).decode()
+
+def _read_manifest(updater) -> dict:    # .manifest.json written into bundles by tools/build_release.py
+    import json
+    try:
+        with open(updater._staging_path() + '/' + updater.manifest_file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _load_manifest(updater):    # -> {path: {'size', 'sha'}} from the staged manifest, None if unusable
+    staging = updater._staging_path() + '/'
+    try:
+        with open(staging + updater.manifest_file, 'rb') as f:
+            data = f.read()
+    except OSError:
+        _log.warning('No manifest to verify the download against (build with tools/build_release.py)')
+        return None
+    if updater.manifest_key:
+        try:
+            with open(staging + updater.signature_file) as f:
+                signature = f.read().strip()
+        except OSError:
+            signature = None
+        if signature != _hmac_sha256(updater.manifest_key, data):
+            _log.error('Manifest signature is missing or wrong')
+            return None
+    import json
+    try:
+        return json.loads(data)['files']
+    except (ValueError, KeyError):
+        _log.warning('Manifest is not readable')
+        return None
+
+def _apply_signed_manifest(updater, version, entries):
+    # File-by-file downloads with a manifest_key: fetch the release's signed manifest
+    # and take every file's SHA from it rather than from the (unsigned) listing
+    staging = updater._staging_path() + '/'
+    for (name, local) in (('manifest.json', updater.manifest_file), ('manifest.json.sig', updater.signature_file)):
+        asset = updater._find_release_asset(version, name)
+        if not asset:
+            _log.warning('Release {} has no signed manifest ({})', version, name)
+            return False
+        try:
+            with updater._http_get(asset['url'], {'Accept': 'application/octet-stream'}) as response:
+                if response.status_code != 200:
+                    _log.warning('Bad status {} from {}', response.status_code, asset['url'])
+                    yield from updater._drain_steps(response)
+                    return False
+                writer = updater._sector_writer(staging + local)
+                try:
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        writer.write(chunk)
+                        yield
+                finally:
+                    writer.close()
+        except Exception as e:
+            _log.warning('Cannot get data from {}: {}', asset['url'], e)
+            return False
+    manifest = _load_manifest(updater)
+    if manifest is None:
+        return False
+    prefix = updater.github_src_dir + updater.repo_dir + '/'
+    for file in entries:
+        if file['type'] == 'file':
+            signed = manifest.get(file['path'][len(prefix):])
+            if signed is None:
+                _log.warning('Not in the signed manifest: {}', file['path'])
+                return False
+            file['sha'] = signed['sha']
+            file['size'] = signed['size']
+    return True
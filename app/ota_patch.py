@@ -0,0 +1,86 @@
+# Applies tools/make_patches.py patches for OTAUpdater(patches_asset=...);
+# loaded by OTAUpdater._patch_file_steps
+
+
+class _Patcher:
+    """
+    Apply a tools/make_patches.py patch as it streams in: added bytes go straight to the
+    writer, copied ranges are read from the installed file through one small buffer.
+    """
+
+    END, COPY, ADD = 0, 1, 2
+
+    def __init__(self, base, writer, buf):
+        self.base = base        # installed file, open for reading
+        self.writer = writer
+        self.buf = buf
+        self.head = bytearray(9)
+        self.hfill = 0          # bytes of the current header received so far
+        self.need = 4           # header bytes wanted: the magic first, then an op byte
+        self.started = False
+        self.adding = 0         # bytes of an ADD still to come
+        self.done = False       # END seen
+        self.ok = True
+
+    def feed(self, data):
+        data = memoryview(data)
+        pos = 0
+        while pos < len(data) and not self.done:
+            if self.adding:
+                take = min(self.adding, len(data) - pos)
+                self.writer.write(data[pos:pos + take])
+                self.adding -= take
+                pos += take
+                continue
+            take = min(self.need - self.hfill, len(data) - pos)
+            self.head[self.hfill:self.hfill + take] = data[pos:pos + take]
+            self.hfill += take
+            pos += take
+            if self.hfill == self.need:
+                self._header()
+
+    def _header(self):
+        head = self.head
+        if not self.started:
+            self.started = True
+            if bytes(head[:4]) != b'OTP1':
+                self._fail()
+            else:
+                self._expect(1)
+            return
+        op = head[0]
+        if self.need == 1:    # know the operation now, read its arguments
+            if op == self.END:
+                self.done = True
+            elif op == self.COPY:
+                self.need = 9
+            elif op == self.ADD:
+                self.need = 5
+            else:
+                self._fail()
+            return
+        length = int.from_bytes(bytes(head[self.need - 4:self.need]), 'little')
+        if op == self.COPY:
+            self._copy(int.from_bytes(bytes(head[1:5]), 'little'), length)
+        else:
+            self.adding = length
+        self._expect(1)
+
+    def _copy(self, offset, length):
+        view = memoryview(self.buf)
+        self.base.seek(offset)
+        while length and self.ok:
+            n = self.base.readinto(view[:min(len(view), length)])
+            if not n:
+                self._fail()    # patch reaches past the end of the installed file
+                return
+            self.writer.write(view[:n])
+            length -= n
+
+    def _expect(self, n):
+        self.hfill = 0
+        self.need = n
+
+    def _fail(self):
+        self.ok = False
+        self.done = True
@@ -0,0 +1,162 @@
+# Flash, heap and time estimates made before an update writes anything
+# (see OTAUpdater._plan_update)
+
+import os
+
+from .ota_updater import (_log, _blocks, _mem_free,
+                          DOWNLOAD_CHUNK_SIZE, FLASH_SECTOR_SIZE, GZIP_WINDOW, HEAP_MARGIN)
+
+
+def _make_plan(updater, version):
+    stat = os.statvfs(updater.module or '/')
+    block = stat[1] or stat[0]
+    free = stat[1] * stat[4]    # f_frsize * f_bavail
+    newdir = updater.modulepath(updater.new_version_dir)
+    pending = updater._pending_version()
+    staging = updater._staging_path()
+
+    # flash _create_new_version_file() gives back before staging starts
+    reclaim = 0
+    if pending is not None and pending != version:
+        reclaim += updater._tree.allocated(newdir, block)
+    if staging != newdir and pending != version:
+        reclaim += updater._tree.allocated(staging, block)
+    legacy = updater.modulepath(updater.main_dir)
+    if updater._active_slot() and updater._exists_dir(legacy):
+        reclaim += updater._tree.allocated(legacy, block)
+
+    # flash: still to be written; total: the whole new version (4 blocks: .version files, state...)
+    plan = {'mode': 'full', 'transfer': 0, 'requests': 0, 'flash': 4 * block, 'total': 4 * block,
+            'free': free + reclaim, 'compressed': updater.compressed and updater._can_inflate(),
+            'unchanged': None, 'unchanged_bytes': 0}
+    copying = not updater.slots and updater._state_record()['rename'] is False
+    installed = updater._tree.allocated(updater.modulepath(updater.main_dir), block) if copying else None
+    staged = staging if pending == version else None
+    bundle = _plan_bundle(updater, version)
+    entries = None
+    if bundle is not None:
+        name, size = bundle
+        plan['mode'] = 'bundle'
+        plan['transfer'] = size
+        plan['requests'] = 1
+        # Every tar member starts with a 512 byte header, so an uncompressed bundle's
+        # files take at most a block per 512 bytes of it. When even that fits, the bundle
+        # stays the only request; otherwise (or compressed) the listing has to tell.
+        bound = None if updater._compressed_bundle(name) else (size + 511) // 512 * block
+        entries = []
+        if bound is not None and _fits(plan, bound, installed):
+            plan['flash'] += bound
+            plan['total'] += bound
+        elif not updater._list_git_tree(version, entries):
+            entries = None
+    if entries is None:
+        entries = updater._list_release_files(version)
+    if entries is None:
+        return None
+    _plan_files(updater, plan, version, entries, block, staged)
+
+    seconds = _estimate_seconds(updater, plan['transfer'], plan['requests'])
+    if plan['mode'] == 'full' and updater.max_update_seconds and seconds > updater.max_update_seconds:
+        _plan_unchanged(updater, plan, entries, staged)    # only now worth hashing the installed files
+        delta = _estimate_seconds(updater, plan['transfer'] - plan['unchanged_bytes'],
+                                  plan['requests'] - len(plan['unchanged'] or ()))
+        if delta <= updater.max_update_seconds:
+            _log.info('A full download would take ~{} s, fetching changed files only', seconds)
+            plan['mode'] = 'delta'
+    elif plan['mode'] == 'full' and updater.delta_update:
+        _plan_unchanged(updater, plan, entries, staged)
+        plan['mode'] = 'delta'
+    if plan['mode'] == 'delta':
+        plan['transfer'] -= plan['unchanged_bytes']
+        plan['requests'] -= len(plan['unchanged'] or ())
+        seconds = _estimate_seconds(updater, plan['transfer'], plan['requests'])
+    plan['seconds'] = seconds
+
+    heap = _mem_free()
+    needed = FLASH_SECTOR_SIZE + DOWNLOAD_CHUNK_SIZE + HEAP_MARGIN
+    if heap is not None and plan['compressed'] and heap < needed + DOWNLOAD_CHUNK_SIZE + GZIP_WINDOW:
+        _log.warning('Not enough heap to inflate responses, downloading them uncompressed')
+        plan['compressed'] = False
+
+    if plan['flash'] > plan['free']:
+        return _abort(plan, 'needs {} bytes of flash, {} free'.format(plan['flash'], plan['free']))
+    if not _fits(plan, 0, installed):
+        return _abort(plan, 'not enough flash to install by copying')
+    if heap is not None and heap < needed:
+        return _abort(plan, 'needs {} bytes of heap, {} free'.format(needed, heap))
+    if updater.max_update_seconds and seconds > updater.max_update_seconds:
+        return _abort(plan, 'would take ~{} s'.format(seconds))
+    return plan
+
+def _abort(plan, reason):
+    plan['mode'] = 'abort'
+    plan['reason'] = reason
+    return plan
+
+def _fits(plan, more, installed):    # whether the plan, plus more bytes of files, fits on flash
+    if plan['flash'] + more > plan['free']:
+        return False
+    # installed is None unless installing copies next/ over main_dir once the old version
+    # is deleted: then the new version must fit twice beside the space the old one frees
+    return installed is None or plan['free'] - plan['flash'] - more + installed >= plan['total'] + more
+
+def _plan_bundle(updater, version):    # -> (name, size) of the bundle the download will fetch, or None
+    names = []
+    if updater.compiled_asset and updater._mpy_version() is not None:
+        names.append(updater.compiled_asset.format(updater._mpy_version()))
+    if updater.bundle_asset:
+        names.append(updater.bundle_asset)
+    for name in names:
+        if not updater._can_unpack(name):
+            _log.info('This firmware cannot inflate {}, not using it', name)
+            continue
+        asset = updater._find_release_asset(version, name)
+        if asset:
+            return name, asset['size']
+    return None
+
+def _plan_files(updater, plan, version, entries, block, staged):
+    # staged: the directory already holding part of this version, if any
+    bundled = plan['mode'] == 'bundle'    # only the flash figure is needed from the listing
+    patches = updater._patch_index(version) if updater.patches_asset and not bundled else {}
+    prefix = updater.github_src_dir + updater.repo_dir + '/'
+    for file in entries:
+        relPath = file['path'][len(prefix):]
+        if file['type'] != 'file':
+            plan['flash'] += block
+            plan['total'] += block
+            continue
+        size = file.get('size') or 0
+        have = updater._file_size(staged + '/' + relPath) if staged else 0
+        plan['flash'] += _blocks(size, block) - _blocks(min(have, size), block)
+        plan['total'] += _blocks(size, block)
+        if bundled:
+            continue
+        patch = patches.get(relPath)
+        if patch and patch.get('sha') == file.get('sha') and not have:
+            plan['transfer'] += patch['patch_size']    # if the installed copy is the patch's base
+        else:
+            plan['transfer'] += size - min(have, size)
+        plan['requests'] += 1
+
+def _plan_unchanged(updater, plan, entries, staged):
+    # The files a delta stage would copy from flash instead of fetching: every
+    # installed file is read and hashed, so only when a delta is wanted.
+    if updater.manifest_key:
+        return    # the manifest, not the listing, is trusted: hashed while staging
+    unchanged = set()
+    prefix = updater.github_src_dir + updater.repo_dir + '/'
+    for file in entries:
+        relPath = file['path'][len(prefix):]
+        if file['type'] != 'file' or (staged and updater._file_size(staged + '/' + relPath)):
+            continue
+        if updater._git_blob_sha(updater._main_path() + '/' + relPath) == file.get('sha'):
+            unchanged.add(relPath)
+            plan['unchanged_bytes'] += file.get('size') or 0
+    plan['unchanged'] = unchanged
+
+def _estimate_seconds(updater, transfer, requests):
+    # round trips as slow as this run's version check, bytes at link_speed
+    check = updater.metrics.get('check', {})
+    per_request = check.get('ms', 0) / max(check.get('requests', 0), 1) / 1000
+    return int(requests * per_request + transfer / updater.link_speed) + 1
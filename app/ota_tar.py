@@ -0,0 +1,190 @@
+# Streaming tar unpacker for OTAUpdater(bundle_asset=..., compiled_asset=...),
+# imported by OTAUpdater._download_bundle_steps when a bundle is fetched
+
+from .ota_updater import _log, _blob_hash
+
+
+class _TarUnpacker:
+    """
+    Unpack an uncompressed ustar archive as it streams in, one 512 byte header at a time.
+    Member data goes straight through a _SectorWriter, so the archive is never held in memory.
+
+    mark is where a later request could pick the archive up again: [archive offset, member,
+    size, checked, bad], member being the file whose data starts at offset (None at the
+    start of a header). Given a mark, the unpacker continues from it, and from however much
+    of that member is already on flash.
+    """
+
+    BLOCK = 512
+
+    def __init__(self, updater, dest, mark=None):
+        self.updater = updater
+        self.dest = dest
+        self.header = bytearray(self.BLOCK)
+        self.start()
+        if mark:
+            self._resume(mark)
+
+    def start(self):    # (again) from the first byte of the archive
+        self.offset = 0         # archive bytes consumed
+        self.mark = None
+        self.hfill = 0          # bytes of the current header received so far
+        self.writer = None      # open member file, if any
+        self.remaining = 0      # member data bytes still to come
+        self.skip = 0           # padding (or ignored member) bytes still to come
+        self.done = False       # end-of-archive block seen
+        self.ok = True
+        self.files = 0
+        self.lastdir = None     # most recent directory known to exist
+        self.manifest = None    # {path: {'size', 'sha'}} once the bundle's manifest is in
+        self.member = None      # path of the open member, relative to dest
+        self.bad = []           # members that did not match the manifest
+        self.checked = 0        # members hashed against the manifest
+
+    def _resume(self, mark):
+        (self.offset, member, size, self.checked, bad) = mark
+        self.bad = list(bad)
+        if member is None:
+            return
+        updater = self.updater
+        path = self.dest + '/' + member
+        have = updater._file_size(path)
+        if have > size:
+            have = 0
+        blob = None
+        if updater.verify and member not in (updater.manifest_file, updater.signature_file):
+            self.manifest = updater._load_manifest()    # the first members, so on flash already
+            if self.manifest is None:
+                self.ok = False
+                self.done = True
+                return
+            blob = _blob_hash(size)
+            if have and not updater._hash_prefix(blob, path, have):
+                blob = _blob_hash(size)
+                have = 0
+        self.writer = updater._sector_writer(path, 'ab' if have else 'wb', blob)
+        self.member = member
+        self.remaining = size - have
+        self.skip = (self.BLOCK - size % self.BLOCK) % self.BLOCK
+        self.offset += have
+        if not self.remaining:
+            self._end_member()
+
+    def incomplete(self) -> bool:    # the stream stopped inside a header or a member
+        return not self.done and bool(self.remaining or self.hfill)
+
+    def close(self):    # after a failed request: keep what was written, for a later attempt
+        if self.writer:
+            self.writer.close()
+            self.writer = None
+
+    def feed(self, data):
+        data = memoryview(data)
+        pos = 0
+        while pos < len(data) and not self.done:
+            if self.remaining:
+                take = min(self.remaining, len(data) - pos)
+                if self.writer:
+                    self.writer.write(data[pos:pos + take])
+                self.remaining -= take
+                pos += take
+                self.offset += take
+                if not self.remaining:
+                    self._end_member()
+            elif self.skip:
+                take = min(self.skip, len(data) - pos)
+                self.skip -= take
+                pos += take
+                self.offset += take
+            else:
+                take = min(self.BLOCK - self.hfill, len(data) - pos)
+                self.header[self.hfill:self.hfill + take] = data[pos:pos + take]
+                self.hfill += take
+                pos += take
+                self.offset += take
+                if self.hfill == self.BLOCK:
+                    self.hfill = 0
+                    self._start_member()
+
+    def finish(self) -> bool:
+        if self.writer:    # archive ended in the middle of a member
+            self.writer.close()
+            self.writer = None
+            self.ok = False
+        if self.incomplete():
+            _log.warning('Bundle is truncated')
+            self.ok = False
+        return self.ok
+
+    def _field(self, start, end):
+        field = bytes(self.header[start:end])
+        return field.split(b'\0', 1)[0].decode()
+
+    def _start_member(self):
+        if not any(self.header):
+            self.done = True    # end-of-archive marker
+            return
+        name = self._field(0, 100)
+        prefix = self._field(345, 500)
+        if prefix:
+            name = prefix + '/' + name
+        size = int(self._field(124, 136).strip() or '0', 8)
+        kind = self.header[156]
+        padding = (self.BLOCK - size % self.BLOCK) % self.BLOCK
+
+        parts = [p for p in name.split('/') if p and p != '.']
+        if '..' in parts:
+            _log.warning('Refusing bundle member outside target: {}', name)
+            self.ok = False
+            parts = []
+        if not parts or kind not in (0, ord('0'), ord('5')):
+            self.skip = size + padding    # '.', pax/GNU extension headers, links: ignore
+            return
+
+        rel = '/'.join(parts)
+        path = self.dest + '/' + rel
+        if kind == ord('5'):
+            self.updater._mk_dirs(path)
+            self.lastdir = path
+            return
+        parent = path[:path.rindex('/')]
+        if parent != self.lastdir:    # archives need not list directories before their files
+            self.updater._mk_dirs(parent)
+            self.lastdir = parent
+        blob = None
+        if self.updater.verify and rel not in (self.updater.manifest_file, self.updater.signature_file):
+            if self.manifest is None:    # manifest (and signature) come first, see build_release.py
+                self.manifest = self.updater._load_manifest()
+                if self.manifest is None:
+                    self.ok = False
+                    self.done = True
+                    return
+            if rel not in self.manifest:
+                _log.warning('Bundle member not in manifest: {}', rel)
+                self.ok = False
+            blob = _blob_hash(size)
+        try:
+            self.writer = self.updater._sector_writer(path, blob=blob)
+            self.member = rel
+            self.mark = [self.offset, rel, size, self.checked, list(self.bad)]
+        except Exception as e:
+            _log.warning('A file could not be opened : {}', e)
+            self.ok = False
+            self.writer = None
+        self.files += 1
+        self.remaining = size
+        self.skip = padding
+        if not size:
+            self._end_member()
+
+    def _end_member(self):
+        if self.writer:
+            self.writer.close()
+            if self.writer.blob and self.manifest is not None:
+                self.checked += 1
+                expected = self.manifest.get(self.member, {}).get('sha')
+                if self.writer.sha() != expected:
+                    _log.warning('Bundle member does not match manifest: {}', self.member)
+                    self.bad.append(self.member)
+            self.writer = None
+            self.mark = [self.offset + self.skip, None, 0, self.checked, list(self.bad)]
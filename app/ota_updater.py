@@ -1,11 +1,449 @@
 import os
 import gc
+import time
+import binascii
+import hashlib
+
+# adafruit_connection_manager, adafruit_requests and wifi are imported on the first request
+# (see OTAUpdater._session), so a boot with no pending update never loads the network stack.
+# The same goes for the parts of the updater not every run needs, each in its own module
+# beside this one: the planner (ota_plan), bundles (ota_tar), patches (ota_patch),
+# decompression (ota_inflate), manifests (ota_manifest) and wake records (ota_wake).
+
+DOWNLOAD_CHUNK_SIZE = 1024    # bytes read from the socket at a time
+FLASH_SECTOR_SIZE   = 4096    # bytes; downloads are written to flash in whole sectors
+GITHUB_SOURCE       = ('https://api.github.com', 'https://raw.githubusercontent.com')    # (API, raw files)
+HEAP_MARGIN         = 8 * 1024    # bytes of heap for JSON, strings and sockets beyond the fixed buffers
+GZIP_WINDOW         = 32 * 1024   # history an HTTP gzip/deflate response may need while inflating
+CLOCK_SET_AFTER     = 1577836800    # 2020-01-01; an earlier time.time() means the RTC was never set
+JOURNAL_SAVE_MS     = 30000       # download progress is saved with the state at most this often
+LOG_RING_SIZE       = 32          # latest log messages kept in RAM for the log file
+LOG_FILE_LIMIT      = 16 * 1024   # bytes; a longer log file is started afresh
+
+LOG_DEBUG, LOG_INFO, LOG_WARNING, LOG_ERROR = 10, 20, 30, 40    # OTAUpdater(log_level=...)
+
+
+class _CachingSocketPool:
+    """
+    Socket pool stand-in that remembers getaddrinfo() answers for the run.
+    The connection manager only resolves a host when it has no open socket to reuse,
+    so the lookups counted here are the new connections (and TLS handshakes) per host.
+    """
+
+    def __init__(self, pool):
+        self._pool = pool
+        self._addresses = {}
+        self.connects = {}    # host -> new connections this run
+
+    def getaddrinfo(self, host, port, *args):
+        self.connects[host] = self.connects.get(host, 0) + 1
+        key = (host, port)
+        if key not in self._addresses:
+            self._addresses[key] = self._pool.getaddrinfo(host, port, *args)
+        return self._addresses[key]
+
+    def __getattr__(self, name):    # everything else is the real pool
+        return getattr(self._pool, name)
+
+
+class _SectorWriter:
+    """
+    Coalesce downloaded chunks into sector sized writes through one reused buffer,
+    so peak heap use does not depend on the size of the file being written.
+    """
+
+    def __init__(self, buf, path, mode='wb', blob=None):
+        self.buf = buf
+        self.view = memoryview(buf)
+        self.fill = 0        # bytes waiting in buf
+        self.written = 0     # bytes handed to write() so far
+        self.blob = blob     # optional hash (see _blob_hash) fed with everything written
+        self.file = open(path, mode)
+
+    def write(self, data):
+        data = memoryview(data)
+        size = len(self.buf)
+        pos = 0
+        while pos < len(data):
+            if self.fill == 0 and len(data) - pos >= size:
+                self.file.write(data[pos:pos + size])    # whole sector, no need to copy it first
+                pos += size
+                continue
+            take = min(size - self.fill, len(data) - pos)
+            self.view[self.fill:self.fill + take] = data[pos:pos + take]
+            self.fill += take
+            pos += take
+            if self.fill == size:
+                self.file.write(self.buf)
+                self.fill = 0
+        if self.blob:
+            self.blob.update(data)
+        self.written += len(data)
+
+    def close(self):
+        if self.fill:
+            self.file.write(self.view[:self.fill])
+            self.fill = 0
+        self.file.close()
+
+    def sha(self):    # git blob id of everything written
+        return _blob_sha(self.blob)
+
+
+def _blob_hash(size):    # sha1 as git computes a blob id: "blob <size>\0" + content
+    blob = hashlib.new('sha1')
+    blob.update(b'blob ' + str(size).encode() + b'\0')
+    return blob
+
+def _blob_sha(blob):    # hex digest of a _blob_hash(): the blob's id in git listings
+    return binascii.hexlify(blob.digest()).decode()
+
+
+def _ticks_ms():
+    return time.monotonic_ns() // 1000000    # float monotonic() loses precision on long uptimes
+
+def _mem_free():
+    try:
+        return gc.mem_free()
+    except AttributeError:
+        return None    # not CircuitPython (e.g. the host simulator)
+
+
+class _Log:
+    """
+    Leveled log of the updater. A message is a format string and its arguments, only
+    formatted when it is printed or written out, so one below the level costs a comparison.
+    Messages at or above the level are printed (unless echo is off) and kept in a fixed
+    ring of the latest LOG_RING_SIZE. The ring is appended to the log file in one go when
+    an error is logged, or by flush() at the end of a run that had warnings; a clean run
+    writes nothing to flash.
+    """
+
+    NAMES = {LOG_DEBUG: 'DEBUG', LOG_INFO: 'INFO', LOG_WARNING: 'WARNING', LOG_ERROR: 'ERROR'}
+
+    def __init__(self):
+        self.level = LOG_INFO
+        self.echo = True
+        self.path = 'ota.log'        # None: never written
+        self.ring = [None] * LOG_RING_SIZE
+        self.next = 0                # ring slot for the next message
+        self.worst = 0               # highest level kept since the last flush
+
+    def configure(self, level, echo, path):
+        self.level = level
+        self.echo = echo
+        self.path = path
+
+    def debug(self, fmt, *args):
+        if self.level <= LOG_DEBUG:
+            self._keep(LOG_DEBUG, fmt, args)
+
+    def info(self, fmt, *args):
+        if self.level <= LOG_INFO:
+            self._keep(LOG_INFO, fmt, args)
+
+    def warning(self, fmt, *args):
+        if self.level <= LOG_WARNING:
+            self._keep(LOG_WARNING, fmt, args)
+
+    def error(self, fmt, *args):
+        self._keep(LOG_ERROR, fmt, args)
+        self.flush()    # now, in case the board resets before the run ends
+
+    def _keep(self, level, fmt, args):
+        self.ring[self.next] = (level, fmt, args)
+        self.next = (self.next + 1) % LOG_RING_SIZE
+        if level > self.worst:
+            self.worst = level
+        if self.echo:
+            print(fmt.format(*args) if args else fmt)
+
+    def flush(self, force=False):
+        # append the ring to the log file, oldest first, if it holds a warning or error
+        # (or force), then empty it for the next run
+        if self.path and (force or self.worst >= LOG_WARNING):
+            try:
+                try:
+                    mode = 'w' if os.stat(self.path)[6] > LOG_FILE_LIMIT else 'a'
+                except OSError:
+                    mode = 'w'
+                with open(self.path, mode) as f:
+                    f.write('-- {}\n'.format(int(time.time())))
+                    for i in range(LOG_RING_SIZE):
+                        entry = self.ring[(self.next + i) % LOG_RING_SIZE]
+                        if entry is not None:
+                            (level, fmt, args) = entry
+                            f.write(self.NAMES[level] + ' ' + (fmt.format(*args) if args else fmt) + '\n')
+            except OSError as e:    # e.g. drive is read-only
+                if self.echo:
+                    print(f"Cannot write {self.path}: {e}")
+        for i in range(LOG_RING_SIZE):
+            self.ring[i] = None
+        self.next = 0
+        self.worst = 0
+
+
+_log = _Log()    # shared by the updater and its helpers; see OTAUpdater(log_level=...)
+
+
+class _Phase:
+    """One timed phase of an update run; see _Telemetry."""
+
+    def __init__(self, telemetry, name, detail=None):
+        self.telemetry = telemetry
+        self.name = name
+        self.detail = detail
+
+    def __enter__(self):
+        t = self.telemetry
+        self.start = _ticks_ms()
+        self.bytes = t.bytes
+        self.requests = t.requests
+        self.mem_low = None
+        t.open_phases.append(self)
+        t.sample()
+        return self
+
+    def __exit__(self, *exc_info):
+        t = self.telemetry
+        t.sample()
+        t.open_phases.remove(self)
+        record = {
+            'ms':       _ticks_ms() - self.start,
+            'bytes':    t.bytes - self.bytes,
+            'requests': t.requests - self.requests,
+            'mem_low':  self.mem_low,
+            'count':    1,
+        }
+        total = t.metrics.get(self.name)
+        if total is None:
+            t.metrics[self.name] = dict(record)
+        else:    # e.g. one 'file' phase per file: add them up
+            for key in ('ms', 'bytes', 'requests', 'count'):
+                total[key] += record[key]
+            if total['mem_low'] is None or (record['mem_low'] is not None and record['mem_low'] < total['mem_low']):
+                total['mem_low'] = record['mem_low']
+        if t.hook:
+            if self.detail is not None:
+                record['path'] = self.detail
+            try:
+                t.hook(self.name, record)
+            except Exception as e:
+                _log.warning('on_metrics hook failed: {}', e)
+        return False
+
+
+class _Telemetry:
+    """
+    Per-phase measurements of an update run: elapsed ms, response bytes, HTTP requests
+    and the lowest gc.mem_free() seen. Phases that repeat (one 'file' per download)
+    are added together, with 'count' saying how many there were.
+    """
+
+    def __init__(self, hook=None):
+        self.hook = hook          # called as hook(phase_name, record) after every phase
+        self.metrics = {}
+        self.bytes = 0            # running totals, see _Phase
+        self.requests = 0
+        self.open_phases = []
+
+    def phase(self, name, detail=None):
+        return _Phase(self, name, detail)
+
+    def sample(self):    # heap low-water mark for every phase in progress
+        free = _mem_free()
+        if free is None:
+            return
+        for phase in self.open_phases:
+            if phase.mem_low is None or free < phase.mem_low:
+                phase.mem_low = free
+
+
+class _StateStore:
+    """
+    The updater's own state in one small record, read once and rewritten whole: per
+    directory the installed and pending versions and the download journal, plus the
+    latest-release ETag, the check schedule, component versions and whether os.rename
+    works on this filesystem. On flash it is a CRC32 line and then the JSON. It is written
+    beside the old one as <file>.new and renamed over it, so an interrupted save leaves
+    one of the two intact, and a damaged record is never used.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.record = None     # loaded on first use
+        self.dirty = False
+        self.saved_ms = 0      # _ticks_ms() of the last load or save
+        self.legacy = []       # files the record replaces, removed once it is saved
+
+    def load(self, migrate):
+        # migrate() builds the record from the older separate files when there is none
+        if self.record is None:
+            self.record = self._read(self.path) or self._read(self.path + '.new')
+            if self.record is None:
+                self.record = migrate()
+                self.dirty = True
+                self.save()
+            self.saved_ms = _ticks_ms()
+        return self.record
+
+    @staticmethod
+    def _read(path):
+        import json
+        try:
+            with open(path, 'rb') as f:
+                (crc, body) = f.read().split(b'\n', 1)
+            if int(crc, 16) == binascii.crc32(body):
+                return json.loads(body)
+        except (OSError, ValueError):
+            pass
+        return None
+
+    def save(self) -> bool:
+        if not self.dirty:
+            return True
+        import json
+        body = json.dumps(self.record).encode()
+        try:
+            with open(self.path + '.new', 'wb') as f:
+                f.write('{:08x}\n'.format(binascii.crc32(body)).encode())
+                f.write(body)
+            try:
+                os.remove(self.path)    # FAT will not rename over an existing file
+            except OSError:
+                pass
+            os.rename(self.path + '.new', self.path)
+        except OSError as e:
+            _log.warning('Cannot save {}: {}', self.path, e)    # e.g. drive is read-only
+            return False
+        self.dirty = False
+        self.saved_ms = _ticks_ms()
+        while self.legacy:
+            try:
+                os.remove(self.legacy.pop())
+            except OSError:
+                pass
+        return True
+
+
+S_IFMT  = 0xF000    # os.stat() mode bits
+S_IFDIR = 0x4000
+
+
+class _FlashTree:
+    """
+    Directory tree operations for the updater: existence tests from os.stat() mode bits,
+    binary copies through one reused sector sized buffer, and walks that use an explicit
+    stack rather than recursion. Only failures are logged.
+    """
+
+    def __init__(self, get_buffer):
+        self.get_buffer = get_buffer    # returns the shared, preallocated copy buffer
+
+    @staticmethod
+    def is_dir(path) -> bool:
+        try:
+            return os.stat(path)[0] & S_IFMT == S_IFDIR
+        except OSError:
+            return False
+
+    @staticmethod
+    def mkdirs(path) -> bool:
+        made = '/' if path.startswith('/') else ''
+        for part in path.split('/'):
+            if not part:
+                continue
+            made += part
+            if not _FlashTree.is_dir(made):
+                try:
+                    os.mkdir(made)
+                except OSError as e:
+                    _log.warning('Cannot create directory {}: {}', made, e)
+                    return False
+            made += '/'
+        return True
+
+    def copy_file(self, fromPath, toPath) -> bool:
+        buf = self.get_buffer()
+        view = memoryview(buf)
+        try:
+            with open(fromPath, 'rb') as fromFile:    # binary: .mpy files are not text
+                with open(toPath, 'wb') as toFile:
+                    while True:
+                        n = fromFile.readinto(buf)
+                        if not n:
+                            break
+                        toFile.write(view[:n] if n < len(buf) else buf)
+        except OSError as e:
+            _log.warning('Could not copy {} to {}: {}', fromPath, toPath, e)
+            return False
+        return True
+
+    def copy_tree(self, fromPath, toPath) -> bool:
+        ret_status = True
+        pending = [(fromPath, toPath)]
+        while pending:
+            (src, dst) = pending.pop()
+            if not self.mkdirs(dst):
+                return False
+            for name in os.listdir(src):
+                if self.is_dir(src + '/' + name):
+                    pending.append((src + '/' + name, dst + '/' + name))
+                elif not self.copy_file(src + '/' + name, dst + '/' + name):
+                    ret_status = False
+        return ret_status
+
+    def remove_tree(self, directory) -> bool:
+        ret_status = True
+        pending = [directory]
+        emptied = []    # directories in the order found; removed last-found first
+        while pending:
+            path = pending.pop()
+            try:
+                names = os.listdir(path)
+            except OSError as e:
+                _log.warning('FAILED to list {}: {}', path, e)
+                ret_status = False
+                continue
+            emptied.append(path)
+            for name in names:
+                entry = path + '/' + name
+                if self.is_dir(entry):
+                    pending.append(entry)
+                else:
+                    try:
+                        os.remove(entry)
+                    except OSError as e:
+                        _log.warning('FAILED to remove {}: {}', entry, e)
+                        ret_status = False
+        while emptied:
+            path = emptied.pop()
+            try:
+                os.rmdir(path)
+            except OSError as e:
+                _log.warning('FAILED to remove directory {}: {}', path, e)
+                ret_status = False
+        return ret_status
 
-import adafruit_connection_manager
-import adafruit_pathlib
-import adafruit_requests
+    def allocated(self, directory, block) -> int:    # flash taken by a tree, in whole blocks
+        total = 0
+        pending = [directory] if self.is_dir(directory) else []
+        while pending:
+            path = pending.pop()
+            total += block    # the directory's own entries
+            for name in os.listdir(path):
+                entry = path + '/' + name
+                stat = os.stat(entry)
+                if stat[0] & S_IFMT == S_IFDIR:
+                    pending.append(entry)
+                else:
+                    total += _blocks(stat[6], block)
+        return total
+
+
+def _blocks(size, block):    # bytes a file of size bytes occupies on a filesystem of block sized clusters
+    return (size + block - 1) // block * block
 
-import wifi
 
 class OTAUpdater:
     """
@@ -19,12 +457,80 @@ class OTAUpdater:
                          
                          main_dir='app',     # most client FW should in filesystem at /<main_dir/>mycode.py
                          module='',          # used when client FW is in filesystem at /<module/><main_dir/>mycode.py
+                         repo_dir=None,      # main_dir's path in the repo below github_src_dir, when not main_dir
                          new_version_dir='next',         # download firware into filesystem/new_version_dir
                          new_version_file='.version' ,   # name of file containing current or available version
                                                         
                          secrets_file="settings.toml",    # expect this in filesystem at <secrets_file>
                                                           # As parameter, include any other path component,
                                                           # e.g. /app/secrets.txt
+
+                         delta_update=False,    # only download files whose git blob SHA differs
+                                                # from the installed copy; carry the rest over from flash
+                         listing='contents',    # 'contents': one GitHub API request per directory
+                                                # 'tree': whole release in one git/trees request
+                         bundle_asset=None,     # name of a release asset holding main_dir as one
+                                                # uncompressed ustar archive, e.g. 'app.tar' built by
+                                                # tools/build_release.py or (with verify=False, as it
+                                                # has no manifest) tar --format=ustar -cf app.tar -C app .
+                                                # When set, the update is one download instead of one per file
+                         compiled_asset=None,   # e.g. 'app-mpy{}.tar': bundle of precompiled .mpy files,
+                                                # {} being the bytecode version this firmware loads.
+                                                # Built by tools/build_release.py; when the release has
+                                                # none for this device, bundle_asset or .py files are used
+                         compressed=False,      # ask for gzip/deflate file downloads and inflate them on the
+                                                # way to flash. Needs a streaming zlib, which CircuitPython
+                                                # lacks (its zlib only has one-shot decompress()): there
+                                                # this does nothing and files come uncompressed. Works on
+                                                # MicroPython and in the host simulator. Likewise bundles
+                                                # named *.tar.zlib or *.tar.gz are only used where they
+                                                # can be inflated; elsewhere files are fetched one by one
+                         sources=None,          # where to get releases from, in order of preference, e.g.
+                                                # ['http://192.168.1.10:8080', 'github']: a URL is an
+                                                # ota_mirror.py (tools/) serving /api and /raw, 'github'
+                                                # is GitHub itself, or give an (api_base, raw_base) tuple.
+                                                # A source that is down or lacks the release is skipped
+                         fastest_source=False,  # time one small request to each source first
+                                                # and prefer them in order of response time
+                         patches_asset=None,    # e.g. 'patches.json' from tools/make_patches.py: rebuild a
+                                                # changed file from the installed copy and a small patch
+                                                # when the release has one for it (file by file updates).
+                                                # With components, {} is the component's name, e.g.
+                                                # 'patches-{}.json' (make_patches.py --index patches-lib.json)
+                         verify=True,           # hash every file as it is written and check it against the
+                                                # git blob SHA from the listing or the release manifest;
+                                                # a staged tree that does not verify is never installed
+                         manifest_key=None,     # shared secret: only trust a manifest signed with it by
+                                                # tools/build_release.py --key (default: OTA_MANIFEST_KEY
+                                                # from settings.toml); then every file must be listed in it
+                         link_speed=20000,      # bytes/s assumed when estimating how long an update takes
+                         max_update_seconds=None,  # don't start an update estimated to take longer
+                                                # (switching to delta_update if that would fit)
+                         rate_limit_reserve=0,  # defer checks once GitHub reports this few requests remaining
+                         download_retries=2,    # extra attempts per file, continuing from where it stopped
+                         on_metrics=None,       # optional callback(phase, record) after every phase of a run;
+                                                # the totals for the last run are in self.metrics
+                         log_level=LOG_INFO,    # LOG_DEBUG also reports every file; LOG_WARNING only problems
+                         log_echo=True,         # print what is logged (False: only keep it for log_file)
+                         log_file='ota.log',    # the latest messages are appended here after an error,
+                                                # or at the end of a run with warnings (None: never)
+                         check_interval=6 * 3600,  # maybe_check(): seconds between successful checks
+                         check_jitter=900,      # up to this many extra seconds, fixed per board (from its
+                                                # UID), so devices that restart together check apart
+                         retry_delay=60,        # first wait after a failed or rate-limited check,
+                         max_backoff=24 * 3600, # doubling each time up to this
+                         slots=None,            # e.g. ('slot_a', 'slot_b'): keep two copies of main_dir at
+                                                # /<slot>/<main_dir>, download into the inactive one and
+                                                # activate it by rewriting the small .ota_slot pointer file.
+                                                # code.py puts /<active slot> first on sys.path.
+                         sleep_memory_offset=0, # where check_after_wake() keeps its 20 byte record
+                                                # in alarm.sleep_memory
+                         components=None,       # e.g. [('app', 'app', 'app'), ('lib', 'lib', 'lib')]: update
+                                                # these (name, directory in the repo below github_src_dir,
+                                                # directory on the device) instead of main_dir, each on its
+                                                # own. Only those whose directory changed in the release
+                                                # are downloaded, in one run and one session. Not with
+                                                # slots, bundle_asset or compiled_asset (ValueError)
                  
                          headers={}    ):    # any other headers, as a dictionary.
                                              # Note that the GitHub auth header 
@@ -36,7 +542,7 @@ class OTAUpdater:
         else :
                 # Build repo from settings
                 if (settings == None):
-                    print("OTAupdater was not given either settings or a GitHub URL");
+                    _log.error('OTAupdater was not given either settings or a GitHub URL')
                     return None
 
                 repo_owner = settings["repo_owner"]
@@ -49,10 +555,52 @@ class OTAUpdater:
         self.github_src_dir = '' if len(github_src_dir) < 1 else github_src_dir.rstrip('/') + '/'
         
         self.module = module.rstrip('/')    # for any extra directory at the top of the filesystem
+        _log.configure(log_level, log_echo, self.modulepath(log_file) if log_file else None)
         self.main_dir = main_dir            # folder for most of the application code in the filesystem
+        self.repo_dir = (repo_dir or main_dir).strip('/')    # the same folder in the repository
         self.new_version_dir = new_version_dir    # where to download the firmware update
         self.new_version_file = new_version_file    # contains version tag of current or next version
         self.secrets_file = secrets_file
+        self.delta_update = delta_update
+        self.listing = listing
+        self.bundle_asset = bundle_asset
+        self.compiled_asset = compiled_asset
+        self.compressed = compressed
+        self.patches_asset = patches_asset
+        self._patches = None        # (version, {path: patch entry}) from the release's patch index
+        self._patch_buf = None      # allocated on first patch, for copying from the installed file
+        self._last_hash = (None, None)    # (path, git blob SHA) of the installed file hashed last
+        self.manifest_file = '.manifest.json'    # file list shipped inside bundles
+        self.signature_file = '.manifest.sig'    # HMAC of the manifest, when signed
+        self.verify = verify
+        self.manifest_key = manifest_key or os.getenv('OTA_MANIFEST_KEY')
+        if isinstance(self.manifest_key, str):
+            self.manifest_key = self.manifest_key.encode()
+        self.sources = [self._source_bases(source) for source in (sources or ['github'])]
+        self.fastest_source = fastest_source
+        self._source_order = None    # indexes into sources, the preferred (last working) one first
+        self.link_speed = link_speed
+        self.max_update_seconds = max_update_seconds
+        self.plan = None            # see _plan_update(): what the last update run decided up front
+        self._listing = None        # (version, entries) so planning and downloading list the release once
+        self._release_assets = None # (version, {name: asset}) likewise for the release's assets
+        self.rate_limit_reserve = rate_limit_reserve
+        self.download_retries = download_retries
+        self.journal_file = '.journal'    # (before .ota_state) in new_version_dir: files finished so far
+        self.slots = slots
+        self._telemetry = _Telemetry(on_metrics)
+        self.slot_file = '.ota_slot'      # name of the active slot, when using slots
+        self.release_cache_file = '.ota_release'    # (before .ota_state) ETag and tag of the last latest release
+        self._rate_limit_until = None               # time.monotonic() before which we do not ask GitHub
+        self.check_interval = check_interval
+        self.check_jitter = check_jitter
+        self.retry_delay = retry_delay
+        self.max_backoff = max_backoff
+        self.schedule_file = '.ota_schedule'    # (before .ota_state) when maybe_check() last ran, and how
+        self._next_check = None                 # time.monotonic() of the next check maybe_check() will make
+        self._failures = 0                      # failed or rate-limited checks in a row
+        self._jitter_fraction = None
+        self.sleep_memory_offset = sleep_memory_offset
 
         # mpython orig: self.http_client = HttpClient(headers=headers)
         # Adafruit Requests replaces micropython-ota-updater htppclient.py HttpClient class 
@@ -68,22 +616,63 @@ class OTAUpdater:
            self.headers.update({"token": token_val})
 
 
-            # Initalize Wifi, Socket Pool, Request Session
-        self.pool = adafruit_connection_manager.get_radio_socketpool(wifi.radio)
-        self.ssl_context = adafruit_connection_manager.get_radio_ssl_context(wifi.radio)
-        self.requests = adafruit_requests.Session(self.pool, self.ssl_context)
-            # use "with self.requests.get(url) as var"
+            # Socket Pool, SSL context and Request Session are created by _session()
+            # on the first request, not here: most boots never make one.
+        self.pool = None
+        self.ssl_context = None
+        self.requests = None
+            # use "with self._http_get(url) as var"
             # where previously we used self.httpclient.get(url)
             #    was xxxx
-            #    now    with self.requests.get(url) as response:
+            #    now    with self._http_get(url) as response:
             #                do something like
             #                text = response.text
             #                json = response.json()
+            # Always close the response (the with block does) so its socket
+            # goes back to the pool for the next request to the same host.
+        self._host_requests = {}   # host -> requests made this run
+        self._sector_buf = None    # allocated on first download or copy, then reused for every file
+        self._inflate_buf = None   # allocated on first compressed download
+        self._tree = _FlashTree(self._buffer)
+        self.state_file = '.ota_state'    # versions, journal, ETag, schedule...: see _StateStore
+        self._state = _StateStore(self.modulepath(self.state_file))
+        self._state_checked = False       # whether _dir_state() has compared pending with the tree
+
+        self.components_file = '.ota_components'    # (before .ota_state) tag and tree SHA of each component
+        self.components = None
+        if components:
+            if slots or bundle_asset or compiled_asset:
+                raise ValueError('components cannot be combined with slots, bundle_asset or compiled_asset')
+            self.components = []
+            for (name, src, directory) in components:
+                component = OTAUpdater(github_repo=self.github_repo, github_src_dir=github_src_dir, main_dir=directory,
+                                       module=module, repo_dir=src, new_version_dir=new_version_dir + '_' + name,
+                                       new_version_file=new_version_file, secrets_file=secrets_file,
+                                       delta_update=delta_update, listing=listing, compressed=compressed,
+                                       patches_asset=patches_asset.format(name) if patches_asset else None,
+                                       verify=verify, manifest_key=manifest_key, sources=sources,
+                                       link_speed=link_speed, max_update_seconds=max_update_seconds,
+                                       download_retries=download_retries, log_level=log_level, log_echo=log_echo,
+                                       log_file=log_file, headers=headers)
+                component.name = name
+                component._telemetry = self._telemetry    # one set of metrics for the run
+                component._state = self._state            # and one state record
+                self.components.append(component)
 
     
 
+    @property
+    def metrics(self) -> dict:
+        """Phase -> {'ms', 'bytes', 'requests', 'mem_low', 'count'} for the latest update run.
+
+        Phases: 'check', 'listing', 'download' (containing one 'file' per downloaded file),
+        'secrets', 'delete' and 'install'. 'mem_low' is the lowest gc.mem_free() seen.
+        """
+        return self._telemetry.metrics
+
     def __del__(self):
         # mpython orig: self.http_client = None
+        self.close_connections()
         self.requests    = None
         self.ssl_context = None
         self.pool        = None
@@ -132,14 +721,163 @@ class OTAUpdater:
         -------
             bool: true if a new version is available, false otherwise
         """
+        return self._run_steps(self._check_for_update_steps())
+
+    def _check_for_update_steps(self):
+        (current_version, latest_version) = yield from self._check_for_new_version_steps()
+        targets = self._targets(current_version, latest_version)
+        if targets:
+            _log.info('New version {} available, will download and install on next reboot', latest_version)
+        for (updater, _) in targets:
+            updater._create_new_version_file(latest_version)
+        _log.flush()
+        return bool(targets)
+
+    def maybe_check(self) -> bool:
+        """Check for an update if one is due; cheap enough to call on every pass of the app's loop.
+
+        Checks are check_interval seconds apart, plus a per-board jitter. After an error or
+        a rate-limited answer the wait starts at retry_delay and doubles up to max_backoff.
+        The time, outcome and chosen wait of the last check are kept in the state file,
+        so a restart does not bring the next check forward (when the RTC is set).
 
-        (current_version, latest_version) = self._check_for_new_version()
-        if latest_version != current_version:
-            print('New version " + latest_version + " available, will download and install on next reboot')
-            self._create_new_version_file(latest_version)
-            return True
+        Returns
+        -------
+            bool: true if this call found a new version (see check_for_update_to_install_during_next_reboot)
+        """
+        now = time.monotonic()
+        if self._next_check is None:
+            self._next_check = now + self._resume_schedule()
+        if now < self._next_check:
+            return False
 
-        return False
+        try:
+            available = self.check_for_update_to_install_during_next_reboot()
+            outcome = 'rate-limited' if self._rate_limit_until is not None else 'ok'
+        except Exception as e:    # no network, DNS, TLS, bad answer...
+            _log.warning('Update check failed: {}', e)
+            available = False
+            outcome = 'error'
+        self.close_connections()
+
+        self._failures = 0 if outcome == 'ok' else self._failures + 1
+        delay = self._check_delay()
+        if self._rate_limit_until is not None:
+            delay = max(delay, int(self._rate_limit_until - time.monotonic()))
+        self._next_check = time.monotonic() + delay
+        _log.info('Next update check in {} s', delay)
+        self._write_schedule(outcome, delay)
+        _log.flush()
+        return available
+
+    def _check_delay(self):    # seconds until the next check, given the failures so far
+        if self._failures:
+            delay = min(self.retry_delay * 2 ** (self._failures - 1), self.max_backoff)
+        else:
+            delay = self.check_interval
+        return delay + self._jitter()
+
+    def _jitter(self):
+        if self._jitter_fraction is None:
+            try:
+                import microcontroller
+                uid = bytes(microcontroller.cpu.uid)
+            except (ImportError, AttributeError):
+                uid = os.urandom(8)    # no UID: still spread out, just not the same every boot
+            self._jitter_fraction = binascii.crc32(uid) / 2 ** 32
+        return int(self.check_jitter * self._jitter_fraction)
+
+    def _resume_schedule(self):    # seconds from now until the first check of this run
+        check = self._state_record()['check']
+        if check is None:
+            return self._jitter()    # never checked: only the jitter, so a fleet spreads out
+        (last, self._failures, _, delay) = check
+        now = int(time.time())
+        if last > CLOCK_SET_AFTER and now >= last:
+            return max(last + delay - now, 0)
+        # no usable clock: how long ago the last check was is unknown, so keep any
+        # backoff from now; after a good check only the jitter separates the boards
+        return delay if self._failures else self._jitter()
+
+    def _write_schedule(self, outcome, delay):
+        self._state_record()['check'] = [int(time.time()), self._failures, outcome, delay]
+        self._state.dirty = True
+        self._state.save()
+
+    def check_after_wake(self, ssid, password) -> bool:
+        """The smallest update check, for a board that deep sleeps between checks.
+
+        Call this first thing after a timer wake (alarm.wake_alarm is an alarm.time.TimeAlarm).
+        It connects (to the access point that worked last time), makes one conditional
+        request for the latest release, which GitHub answers with a bare 304 when nothing
+        changed, and turns the radio off again unless there is a new version. Nothing is
+        written to flash for an unchanged release: the outcome, failures in a row and the
+        radio-on time are kept in alarm.sleep_memory (see wake_stats()).
+
+        Returns
+        -------
+            bool: true if a new version is available: stay awake and install_update_if_available()
+                  (the radio is still on). Otherwise call deep_sleep_until_next_check().
+        """
+        import wifi
+        record = self._wake_record()
+        self._failures = record.failures
+        started = _ticks_ms()
+        found = False
+        try:
+            wifi.radio.enabled = True
+            if not OTAUpdater._using_network(ssid, password):
+                raise ConnectionError('cannot join ' + str(ssid))
+            latest_version = self.get_latest_version()
+            found = latest_version is not None and latest_version != self._installed_version()
+            ok = latest_version is not None    # None: rate limited, back off like a failure
+        except Exception as e:    # no network, DNS, TLS, bad answer...
+            _log.warning('Update check failed: {}', e)
+            ok = False
+        if not found:
+            self.close_connections()
+            wifi.radio.enabled = False
+        record.radio_ms = _ticks_ms() - started
+        record.radio_ms_total += record.radio_ms
+        record.checks += 1
+        record.failures = 0 if ok else record.failures + 1
+        record.found = found
+        record.save()
+        self._failures = record.failures
+        _log.info('Wake check {}: {} in {} ms of radio', record.checks, 'new version' if found else 'no update', record.radio_ms)
+        _log.flush()
+        return found
+
+    def deep_sleep_until_next_check(self, *alarms):
+        """Deep sleep until the next check_after_wake() is due, or until one of alarms
+        (e.g. an alarm.pin.PinAlarm for a button) goes off. Does not return.
+
+        The timer is check_interval plus this board's jitter, or after failed or rate-limited
+        checks the backoff from retry_delay up to max_backoff, as for maybe_check().
+        """
+        import alarm
+        delay = self._check_delay()
+        if self._rate_limit_until is not None:
+            delay = max(delay, int(self._rate_limit_until - time.monotonic()))
+        _log.info('Next update check in {} s', delay)
+        _log.flush()
+        alarm.exit_and_deep_sleep_until_alarms(alarm.time.TimeAlarm(monotonic_time=time.monotonic() + delay), *alarms)
+
+    def wake_stats(self) -> dict:
+        """What check_after_wake() recorded since the board was powered up:
+        {'checks', 'failures', 'found', 'radio_ms' (last check), 'radio_ms_total'}."""
+        record = self._wake_record()
+        return {'checks': record.checks, 'failures': record.failures, 'found': record.found,
+                'radio_ms': record.radio_ms, 'radio_ms_total': record.radio_ms_total}
+
+    def _wake_record(self):
+        try:
+            import alarm
+            memory = alarm.sleep_memory
+        except (ImportError, AttributeError):
+            memory = None    # this board cannot deep sleep
+        from .ota_wake import _WakeRecord
+        return _WakeRecord(memory, self.sleep_memory_offset)
 
     def install_update_if_available_after_boot(self, ssid, password) -> bool:
         """This method will install the latest version if out-of-date after boot.
@@ -151,16 +889,20 @@ class OTAUpdater:
         - If no, the WIFI connection is not initialized as no new known version is available
         """
 
-        if self.new_version_dir in os.listdir(self.module):
-            if self.new_version_file in os.listdir(self.modulepath(self.new_version_dir)):
-                latest_version = self.get_version( self.modulepath(self.new_version_dir), self.new_version_file)
-                print('New update found: ', latest_version)
-                OTAUpdater._using_network(ssid, password)        # initialize wifi
-                self.install_update_if_available()
-                return True
-            
-        print('No new updates found...')
-        return False
+        # one read of the state file, no directory listings and no network imports when nothing is pending
+        latest_version = None
+        for updater in self.components or [self]:
+            latest_version = updater._dir_state()['pending']
+            if latest_version is not None:
+                break
+        if latest_version is None:
+            _log.info('No new updates found...')
+            return False
+
+        _log.info('New update found: {}', latest_version)
+        OTAUpdater._using_network(ssid, password)        # initialize wifi
+        self.install_update_if_available()
+        return True
 
     def install_update_if_available(self) -> bool:
         """This method will immediately install the latest version if out-of-date.
@@ -173,173 +915,1249 @@ class OTAUpdater:
         -------
             bool: true if a new version is available, false otherwise
         """
+        try:
+            return self._install_update()
+        finally:
+            _log.flush()    # the run's warnings and errors, if it had any, to log_file
 
+    def _install_update(self) -> bool:
         (current_version, latest_version) = self._check_for_new_version()
-        if latest_version != current_version:
-            print('Updating fromversion {} to {}...'.format(current_version,latest_version))
-            self._create_new_version_file(latest_version)
-            if not self._download_new_version(latest_version):
-                print("Could not download latest version " + latest_version )
+        targets = self._targets(current_version, latest_version)
+        if not targets:
+            return False    # OK, but Update not available
+        _log.info('Updating from version {} to {}...', current_version, latest_version)
+        for (updater, _) in targets:    # stage every component before installing any of them
+            self._share_session(updater)
+            if not updater._stage_version(latest_version):
+                self.close_connections()
                 return False
-            if not self._copy_secrets_file() :
-                print("Could not back up secrets file")
+        self.close_connections()    # no more network traffic in this run
+        for (updater, tree_sha) in targets:
+            if not updater._install_staged(latest_version):
                 return False
-                
-            if not self._delete_old_version() :
-                print("OLD VERSION MAY BE PARTIALLY DELETED")
-                return False
-            
-            if not self._install_new_version() :
-                print("Could not install new version " + latest_version )
+            if updater is not self:
+                self._record_component(updater.name, latest_version, tree_sha)
+        return True    # Update was installed
+
+    def _stage_version(self, latest_version) -> bool:
+        return self._run_steps(self._stage_version_steps(latest_version))
+
+    def _stage_version_steps(self, latest_version):
+        if not self._plan_update(latest_version):
+            return False    # would not fit or finish: nothing written, nothing deleted
+        yield
+        self._create_new_version_file(latest_version)
+        if not (yield from self._download_new_version_steps(latest_version)):
+            _log.error('Could not download latest version {}', latest_version)
+            return False
+        return True
+
+    def _install_staged(self, latest_version) -> bool:
+        if not self._read_journal()[2]:    # 'complete' is only journaled once every file checked out
+            _log.error('Staged version {} is incomplete or failed verification, not installing', latest_version)
+            return False
+        with self._telemetry.phase('secrets'):
+            copied = self._copy_secrets_file()
+        if not copied :
+            _log.error('Could not back up secrets file')
+            return False
+
+        if self.slots:    # nothing to delete or move: just point at the other slot
+            with self._telemetry.phase('install'):
+                activated = self._activate_slot(self._inactive_slot())
+            if not activated:
+                _log.error('Could not activate new version {}', latest_version)
                 return False
-            
-            return True    # Update was installed 
-        
-        return False    # OK, but Update not available
+            self._set_installed(latest_version)
+            return True
 
+        with self._telemetry.phase('delete'):
+            deleted = self._delete_old_version()
+        if not deleted :
+            _log.error('OLD VERSION MAY BE PARTIALLY DELETED')
+            return False
 
-    @staticmethod
-    def _using_network(ssid, password):        # initialize network if  not already active
-        # micropython: import network    
+        with self._telemetry.phase('install'):
+            installed = self._install_new_version()
+        if not installed :
+            _log.error('Could not install new version {}', latest_version)
+            return False
+        self._set_installed(latest_version)
+        return True
+
+
+    async def check(self) -> bool:
+        """asyncio version of check_for_update_to_install_during_next_reboot().
+
+        The latest-release answer is read a chunk at a time, and other tasks run
+        between the chunks (only connecting and sending the request still block).
+
+        Returns
+        -------
+            bool: true if a new version is available, false otherwise
+        """
+        return await self._run_steps_async(self._check_for_update_steps())
+
+    async def download(self) -> bool:
+        """Download (stage) the latest version in the background, without installing it.
 
+        Control goes back to the event loop after every chunk written to flash,
+        so the application keeps servicing its own tasks. Once this returns True,
+        reset the microcontroller: install_update_if_available_after_boot() then
+        installs the staged version without downloading it again.
+
+        Returns
+        -------
+            bool: true if a new version is staged, false otherwise
+        """
+        (current_version, latest_version) = await self._run_steps_async(self._check_for_new_version_steps())
+        downloaded = False
+        for (updater, _) in self._targets(current_version, latest_version):
+            self._share_session(updater)
+            downloaded = await self._run_steps_async(updater._stage_version_steps(latest_version))
+            if not downloaded:
+                break
+        self.close_connections()
+        _log.flush()
+        return downloaded
+
+    @staticmethod
+    def _using_network(ssid, password, ap_file='.wifi_ap', timeout=10, attempts=4, max_delay=8):
+        # initialize network if not already active
+        # micropython: import network
+
+        # Associating is most of the wake-to-update time when the radio has to scan every
+        # channel, so connect straight to the access point (BSSID and channel) that worked
+        # last time. Only if that fails, scan once, pick the strongest AP for the SSID and
+        # connect to it; after that, retry with a doubling pause of at most max_delay s.
         import wifi
-        
-        if not wifi.radio.connected:
-            print('connecting to network...')
+
+        if wifi.radio.connected:
+            _log.info('Connected to WIFI as {}', wifi.radio.ipv4_address)
+            return True
+
+        _log.info('connecting to network...')
+        started = _ticks_ms()
+        hint = OTAUpdater._read_ap_hint(ap_file, ssid)
+        scanned = False
+        delay = 1
+        for attempt in range(attempts):
+            if hint is None and not scanned:
+                hint = OTAUpdater._scan_best_ap(ssid)
+                scanned = True
             try:
-                wifi.radio.connect(ssid, password)
-                
+                if hint:
+                    wifi.radio.connect(ssid, password, channel=hint[1], bssid=hint[0], timeout=timeout)
+                else:
+                    wifi.radio.connect(ssid, password, timeout=timeout)
+                break
             except ConnectionError as e:
-                print("wifi connect error:",e)
-                return False
-                              
-        print('Connected to WIFI as ', wifi.radio.ipv4_address)
-        return True
+                _log.warning('wifi connect error: {}', e)
+                if hint and not scanned:
+                    hint = None    # the AP moved or went away: scan now, no need to wait
+                    continue
+                hint = None
+                if attempt + 1 < attempts:
+                    time.sleep(delay)
+                    delay = min(delay * 2, max_delay)
+        else:
+            return False
 
+        _log.info('Connected to WIFI as {} in {} ms', wifi.radio.ipv4_address, _ticks_ms() - started)
+        OTAUpdater._save_ap_hint(ap_file, ssid, wifi.radio.ap_info)
+        return True
 
-    
+    @staticmethod
+    def _read_ap_hint(ap_file, ssid):    # -> (bssid, channel) of the last good AP for ssid, or None
+        try:
+            with open(ap_file) as f:
+                (saved_ssid, bssid, channel) = f.read().split('\n')[:3]
+            if saved_ssid == ssid:
+                return (binascii.unhexlify(bssid), int(channel))
+        except (OSError, ValueError):
+            pass
+        return None
 
-    def _check_for_new_version(self):
-        current_version = self.get_version(self.modulepath(self.main_dir), self.new_version_file)
-        latest_version = self.get_latest_version()
+    @staticmethod
+    def _scan_best_ap(ssid):    # -> (bssid, channel) of the strongest AP for ssid, or None
+        import wifi
+        best = None
+        try:
+            for network in wifi.radio.start_scanning_networks():
+                if network.ssid == ssid and (best is None or network.rssi > best.rssi):
+                    best = network
+        finally:
+            wifi.radio.stop_scanning_networks()
+        if best is None:
+            _log.warning('No access point for {} in range', ssid)
+            return None
+        _log.info('Best access point for {} on channel {} at {} dBm', ssid, best.channel, best.rssi)
+        return (bytes(best.bssid), best.channel)
 
-        print('Checking version... ')
-        print('\tCurrent version: ', current_version)
-        print('\tLatest version: ', latest_version)
+    @staticmethod
+    def _save_ap_hint(ap_file, ssid, ap):
+        if ap is None:
+            return
+        record = '{}\n{}\n{}\n{}'.format(ssid, binascii.hexlify(ap.bssid).decode(), ap.channel, ap.rssi)
+        try:
+            with open(ap_file) as f:
+                if f.read().split('\n')[:3] == record.split('\n')[:3]:
+                    return    # same AP as last time: spare the flash
+        except OSError:
+            pass
+        try:
+            with open(ap_file, 'w') as f:
+                f.write(record)
+        except OSError as e:
+            _log.warning('Cannot save access point: {}', e)    # e.g. drive is read-only
+
+    def _check_for_new_version(self):    # also starts a fresh set of metrics for this run
+        return self._run_steps(self._check_for_new_version_steps())
+
+    def _check_for_new_version_steps(self):
+        self._telemetry.metrics = {}
+        self._last_hash = (None, None)    # the installed files may have changed since the last run
+        with self._telemetry.phase('check'):
+            current_version = self._installed_version()
+            latest_version = yield from self._get_latest_version_steps()
+
+        _log.info('Checking version... current {}, latest {}', current_version, latest_version)
         return (current_version, latest_version)
 
+    def _installed_version(self):    # tag of the running version; with components, the tags they are at
+        if not self.components:
+            return self._dir_state()['version']
+        records = self._read_components()
+        return ','.join(sorted(set(records.get(c.name, ('0.0', None))[0] for c in self.components)))
+
+    def _targets(self, current_version, latest_version):
+        # -> [(updater, git tree SHA)] to download and install for latest_version: this updater,
+        # or the components whose directory in the repo changed in that release
+        if latest_version is None or latest_version == current_version:
+            return []
+        if not self.components:
+            return [(self, None)]
+        records = self._read_components()
+        stale = [c for c in self.components if records.get(c.name, (None, None))[0] != latest_version]
+        trees = self._component_trees(latest_version, stale) if stale else {}
+        if trees is None:
+            return []    # cannot tell which changed: try again next check
+        targets = []
+        for c in stale:
+            tree_sha = trees.get(c.github_src_dir + c.repo_dir)
+            if tree_sha is None:
+                _log.warning('Release {} has no {} for component {}', latest_version, c.github_src_dir + c.repo_dir, c.name)
+            elif tree_sha == records.get(c.name, (None, None))[1]:
+                _log.info('Component {} is unchanged in {}', c.name, latest_version)
+                records[c.name] = (latest_version, tree_sha)
+            else:
+                targets.append((c, tree_sha))
+        if len(targets) < len(stale):
+            self._write_components(records)
+        return targets
+
+    def _component_trees(self, version, components):
+        # -> {repo path: git tree SHA} of the directories holding the components, from one
+        # contents request per parent directory (usually just the top of the repo), or None
+        trees = {}
+        for parent in set((c.github_src_dir + c.repo_dir).rpartition('/')[0] for c in components):
+            url = 'contents/{}?ref=refs/tags/{}'.format(parent, version)
+            try:
+                with self._api_get(url) as listing:
+                    if listing.status_code != 200:
+                        _log.warning('Bad status {} from {}', listing.status_code, url)
+                        self._drain(listing)
+                        return None
+                    for item in listing.json():
+                        if item['type'] == 'dir':
+                            trees[item['path']] = item['sha']
+            except Exception as e:
+                _log.warning('Cannot get file list from {}: {}', url, e)
+                return None
+        return trees
+
+    def _share_session(self, updater):    # a component makes its requests through this updater's session
+        if updater is not self:
+            updater.requests = self._session()
+            updater._source_order = self._source_order
+            updater._last_hash = (None, None)
+
+    def _read_components(self):    # -> {name: (tag, git tree SHA)} of the installed components
+        return {name: tuple(record) for name, record in self._state_record()['components'].items()}
+
+    def _write_components(self, records):
+        self._state_record()['components'] = {name: list(record) for name, record in records.items()}
+        self._state.dirty = True
+        self._state.save()
+
+    def _record_component(self, name, version, tree_sha):
+        records = self._read_components()
+        records[name] = (version, tree_sha)
+        self._write_components(records)
+
+    def _planned(self, key, default):    # a decision of the plan for this run, or default without one
+        return self.plan[key] if self.plan and key in self.plan else default
+
+    def _plan_update(self, version) -> bool:
+        # Before anything is written: list the release (the download reuses the listing),
+        # work out the flash it needs against what is free, the heap against gc.mem_free()
+        # and roughly how long the transfer takes, then settle on a full or delta stage,
+        # or give up now rather than with old and new half on flash.
+        # The decision is left in self.plan; False means abort.
+        from .ota_plan import _make_plan
+        self.plan = None
+        with self._telemetry.phase('plan'):
+            plan = _make_plan(self, version)
+        if plan is None:
+            return False
+        self.plan = plan
+        if plan['mode'] == 'abort':
+            _log.warning('Not updating to {}: {}', version, plan['reason'])
+            return False
+        _log.info('Plan: {} stage, {} bytes to fetch in ~{} s, {} of {} bytes free flash needed',
+                  plan['mode'], plan['transfer'], plan['seconds'], plan['flash'], plan['free'])
+        return True
+
     def _create_new_version_file(self, latest_version): # save tag for latest_version in
                                                         # file within new_version_dir
                                                         # to indicate that a new version is available
-        self.mkdir(self.modulepath(self.new_version_dir))
+        newdir = self.modulepath(self.new_version_dir)
+        pending_version = self._pending_version()
+        if pending_version == latest_version:
+            return    # keep whatever was already downloaded for this version
+        if pending_version is not None:
+            _log.info('Discarding partial download of version {}', pending_version)
+            self._rmtree(newdir)
+        staging = self._staging_path()
+        if staging != newdir and self._exists_dir(staging):
+            _log.info('Reclaiming inactive slot {}', staging)    # the release before last
+            self._rmtree(staging)
+        legacy = self.modulepath(self.main_dir)
+        if self._active_slot() and self._exists_dir(legacy):
+            _log.info('Reclaiming {}, replaced by slots', legacy)
+            self._rmtree(legacy)
+        self.mkdir(newdir)
         with open(self.modulepath(self.new_version_dir + '/' + self.new_version_file), 'w') as versionfile:
             versionfile.write(latest_version)
             versionfile.close()
+        if staging != newdir:    # the staged slot carries its own version file too
+            self._mk_dirs(staging)
+            with open(staging + '/' + self.new_version_file, 'w') as versionfile:
+                versionfile.write(latest_version)
+        self._set_pending(latest_version)
+
+    def _session(self):
+        # Initialize Socket Pool, SSL context and Request Session on first use.
+        # The pool is wrapped so DNS answers are cached for the run and we can see
+        # how often a request reused an open socket instead of a new TLS handshake.
+        if self.requests is None:
+            import adafruit_connection_manager
+            import adafruit_requests
+            import wifi
+            self.pool = _CachingSocketPool(adafruit_connection_manager.get_radio_socketpool(wifi.radio))
+            self.ssl_context = adafruit_connection_manager.get_radio_ssl_context(wifi.radio)
+            self.requests = adafruit_requests.Session(self.pool, self.ssl_context)
+        return self.requests
+
+    def _http_get(self, url, headers=None):
+        # every request goes through one session, so sockets stay open per host for the run
+        session = self._session()
+        host = url.split('/')[2].split(':')[0]    # as the pool sees it in getaddrinfo(), without the port
+        self._host_requests[host] = self._host_requests.get(host, 0) + 1
+        merged = dict(self.headers)
+        if headers:
+            merged.update(headers)
+        response = session.get(url, headers=merged)
+        self._telemetry.requests += 1
+        self._telemetry.bytes += int(response.headers.get('content-length', 0))
+        return response
+
+    @staticmethod
+    def _drain_steps(response):
+        # Read the rest of a body we have no use for. adafruit_requests hands the socket back
+        # for reuse as it is when a response is closed, so the next request to the host would
+        # read this instead of its status line, drop the socket and connect again.
+        try:
+            for _ in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                yield
+        except Exception:
+            pass    # connection lost: the next request connects again anyway
+
+    def _drain(self, response):
+        self._run_steps(self._drain_steps(response))
+
+    @staticmethod
+    def _source_bases(source):    # -> (API base, raw files base)
+        if isinstance(source, tuple):
+            return (source[0].rstrip('/'), source[1].rstrip('/'))
+        if source == 'github':
+            return GITHUB_SOURCE
+        base = source.rstrip('/')
+        return (base + '/api', base + '/raw')    # the layout tools/ota_mirror.py serves
+
+    def _api_get(self, path, headers=None):    # path below /repos/<repo>/
+        return self._source_get(0, 'repos/' + self.github_repo + '/' + path, headers)
+
+    def _raw_get(self, path, headers=None):    # path is <tag>/<file path>
+        return self._source_get(1, self.github_repo + '/' + path, headers)
+
+    def _source_get(self, kind, path, headers):
+        # Ask the preferred source; if it is unreachable, failing (5xx) or does not have
+        # what we asked for (404, e.g. a mirror that has not synced the release yet),
+        # demote it and ask the next one. The last one's answer or error is final.
+        if self._source_order is None:
+            self._source_order = self._rank_sources() if self.fastest_source else list(range(len(self.sources)))
+        order = list(self._source_order)
+        for i in order:
+            url = self.sources[i][kind] + '/' + path
+            last = i == order[-1]
+            try:
+                response = self._http_get(url, headers)
+            except Exception as e:
+                if last:
+                    raise
+                _log.warning('Source {} failed: {}', self.sources[i][kind], e)
+            else:
+                code = response.status_code
+                if last or (code < 500 and code != 404):
+                    return response
+                self._drain(response)
+                response.close()
+                _log.warning('Source {} answered {}', self.sources[i][kind], code)
+            self._source_order.remove(i)    # keep using the next one for the rest of the run
+            self._source_order.append(i)
+
+    def _rank_sources(self):
+        # one HEAD request per source (whatever the status), fastest first, unreachable last
+        timings = []
+        for i, (_, raw_base) in enumerate(self.sources):
+            started = _ticks_ms()
+            try:
+                self._session().request('HEAD', raw_base + '/' + self.github_repo + '/', headers=self.headers).close()
+                elapsed = _ticks_ms() - started
+            except Exception as e:
+                _log.warning('Source {} unreachable: {}', raw_base, e)
+                elapsed = None
+            self._telemetry.requests += 1
+            timings.append((elapsed is None, elapsed or 0, i))
+        timings.sort()
+        _log.info('Sources by response time: {}', ', '.join('{} {}'.format(self.sources[i][1], 'down' if down else str(ms) + ' ms')
+                                                          for (down, ms, i) in timings))
+        return [i for (_, _, i) in timings]
+
+    def connection_stats(self) -> dict:
+        """Per host: requests made, new connections opened, and requests that reused a socket."""
+        stats = {}
+        for host, count in self._host_requests.items():
+            connects = self.pool.connects.get(host, 0) if self.pool else 0
+            stats[host] = {'requests': count, 'connects': connects, 'reused': max(count - connects, 0)}
+        return stats
+
+    def close_connections(self):
+        """Close the sockets kept open between requests, e.g. at the end of an update run."""
+        if getattr(self, 'pool', None) is None:    # no request made (or __init__ gave up)
+            return
+        for host, stat in self.connection_stats().items():
+            _log.debug('{}: {} requests, {} connections, {} reused', host, stat['requests'], stat['connects'], stat['reused'])
+        self._host_requests = {}
+        self.pool.connects = {}
+        try:
+            import adafruit_connection_manager    # already loaded by _session()
+            adafruit_connection_manager.connection_manager_close_all(self.pool)
+        except Exception as e:
+            _log.warning('Cannot close connections: {}', e)
 
     def get_version(self, directory, version_file_name):    # retrieve version tag from file
                                                             # within existing code dirs
                                                             # OR download directory
-        if version_file_name in os.listdir(directory):
+        try:
             with open(directory + '/' + version_file_name) as f:
                 version = f.read()
                 return version    # from file
+        except OSError:
+            pass
         return '0.0'    # version 0.0 if the active code was never released or updated
 
     def get_latest_version(self):        # retrieve tag of latest/official version from GitHub
-        github_url = 'https://api.github.com/repos/{}/releases/latest'.format(self.github_repo)
-        with self.requests.get(github_url) as latest_release:
-            gh_json = latest_release.json()
-            try:
-                version = gh_json['tag_name']
-            except KeyError as e:
+                                         # or None if GitHub asked us to hold off for now
+        return self._run_steps(self._get_latest_version_steps())
+
+    def _get_latest_version_steps(self):
+        if self._rate_limit_until is not None:
+            wait = self._rate_limit_until - time.monotonic()
+            if wait > 0:
+                _log.info('GitHub rate limit reached, deferring check for {} s', int(wait))
+                return None
+            self._rate_limit_until = None
+
+        github_url = 'releases/latest'
+        headers = {}
+        (etag, cached_version) = self._read_release_cache()
+        if etag and cached_version:
+            headers['If-None-Match'] = etag    # a 304 answer costs no rate limit and no body
+        with self._api_get(github_url, headers) as latest_release:
+            self._note_rate_limit(latest_release)
+            code = latest_release.status_code
+            if code == 304:
+                _log.info('Latest release unchanged since last check')
+                return cached_version
+            if code in (403, 429) and self._rate_limit_until is not None:
+                _log.warning('Rate limited ({}) by {}', code, github_url)
+                yield from self._drain_steps(latest_release)
+                return None
+            (version, start_of_body) = yield from self._scan_tag_name_steps(latest_release)
+            yield from self._drain_steps(latest_release)    # the rest of the release after tag_name
+            if version is None:
                 raise ValueError(
                     "Release not found: \n",
                     " URL was " + github_url + "\n" ,
                     "Please ensure release as marked as 'latest', rather than pre-release \n",
-                    "github api message: \n {} \n ".format(gh_json)
+                    "github api message: \n {} \n ".format(start_of_body)
                 )
+            etag = latest_release.headers.get('etag')
         latest_release.close()
+        if etag:
+            self._write_release_cache(etag, version)
         return version
 
-    def _download_new_version(self, version):
-        newdir = self.modulepath(self.new_version_dir)
-        print('Downloading version {} to {}'.format(version,newdir))
-        if self._download_all_files(version):
-            print('Version {} downloaded to {}'.format(version, newdir))
+    @staticmethod
+    def _scan_tag_name_steps(response):
+        # The release JSON is several KB but we only need tag_name,
+        # so look for it as the body streams in rather than parsing all of it.
+        # Yields after every chunk, like the download steps below.
+        key = b'"tag_name"'
+        buf = b''
+        start_of_body = None    # kept for the error message
+        for chunk in response.iter_content(chunk_size=256):
+            yield
+            if start_of_body is None:
+                start_of_body = bytes(chunk[:200])
+            buf += chunk
+            i = buf.find(key)
+            if i < 0:
+                buf = buf[-len(key):]    # the key may straddle two chunks
+                continue
+            start = buf.find(b'"', i + len(key))
+            end = buf.find(b'"', start + 1) if start >= 0 else -1
+            if end >= 0:
+                return (buf[start + 1:end].decode(), start_of_body)
+            buf = buf[i:]    # value not complete yet
+        return (None, start_of_body)
+
+    def _note_rate_limit(self, response):
+        # GitHub reports the remaining requests and when the window resets (epoch seconds).
+        # Compare the reset with the server's own Date header so the device clock does not matter.
+        remaining = response.headers.get('x-ratelimit-remaining')
+        reset = response.headers.get('x-ratelimit-reset')
+        if remaining is None or reset is None:
+            return
+        if int(remaining) > self.rate_limit_reserve:
+            return
+        now = self._http_date_seconds(response.headers.get('date', ''))
+        wait = int(reset) - now if now else 60
+        self._rate_limit_until = time.monotonic() + max(wait, 1)
+        _log.info('{} GitHub requests left, next check in {} s', remaining, max(wait, 1))
+
+    @staticmethod
+    def _http_date_seconds(date):    # 'Sun, 18 Oct 2026 12:00:00 GMT' -> epoch seconds, 0 if unparsable
+        try:
+            (_, day, month, year, hms, _) = date.split(' ')
+            month = 'JanFebMarAprMayJunJulAugSepOctNovDec'.index(month) // 3 + 1
+            (hour, minute, second) = hms.split(':')
+            year = int(year)
+        except ValueError:
+            return 0
+        if month <= 2:    # days since epoch for a civil date (Howard Hinnant's algorithm)
+            year -= 1
+        era = year // 400
+        yoe = year - era * 400
+        doy = (153 * (month + (-3 if month > 2 else 9)) + 2) // 5 + int(day) - 1
+        doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+        days = era * 146097 + doe - 719468
+        return days * 86400 + int(hour) * 3600 + int(minute) * 60 + int(second)
+
+    def _read_release_cache(self):    # (etag, tag) saved by the last full answer from GitHub
+        record = self._state_record()
+        return (record['etag'], record['latest'])
+
+    def _write_release_cache(self, etag, version):
+        if self._read_release_cache() == (etag, version):
+            return    # unchanged, spare the flash
+        record = self._state_record()
+        (record['etag'], record['latest']) = (etag, version)
+        self._state.dirty = True
+        self._state.save()
+
+    # The download steps below are generators that yield after every chunk and file,
+    # so the async methods can hand control back to the application in between.
+    # The blocking methods simply run them to the end with _run_steps().
+
+    def _run_steps(self, steps):
+        try:
+            while True:
+                next(steps)
+                self._telemetry.sample()
+        except StopIteration as finished:
+            return finished.value
+
+    async def _run_steps_async(self, steps):    # _run_steps(), handing control to the event loop between steps
+        import asyncio
+        try:
+            while True:
+                next(steps)
+                self._telemetry.sample()
+                await asyncio.sleep(0)
+        except StopIteration as finished:
+            return finished.value
+
+    def _download_new_version_steps(self, version):
+        with self._telemetry.phase('download'):
+            return (yield from self._download_version_steps(version))
+
+    def _download_version_steps(self, version):
+        newdir = self._staging_path()
+        _log.info('Downloading version {} to {}', version, newdir)
+        if self._read_journal()[2]:
+            _log.info('Version {} already downloaded to {}', version, newdir)
             return True
-        print('Version {} FAILED to download cleanly to {}'.format(version, newdir))
+        downloaded = False
+        if self.compiled_asset and self._mpy_version() is not None and self._can_unpack(self.compiled_asset):
+            downloaded = yield from self._download_compiled_steps(version)
+            if not downloaded:
+                _log.warning('Falling back to source files')
+                self._restart_staging(version)
+        if not downloaded and self.bundle_asset and self._can_unpack(self.bundle_asset):
+            downloaded = yield from self._download_bundle_steps(version, self.bundle_asset)
+            if not downloaded and self._compressed_bundle(self.bundle_asset):
+                # a compressed bundle cannot be resumed, so the next run would only start it over
+                _log.warning('Falling back to single files')
+                self._restart_staging(version)
+                downloaded = yield from self._download_all_files_steps(version)
+        elif not downloaded:
+            downloaded = yield from self._download_all_files_steps(version)
+        if downloaded:
+            self._journal('complete')    # staged: a later run goes straight to installing
+            _log.info('Version {} downloaded to {}', version, newdir)
+            return True
+        self._state.save()    # what did finish, for the next attempt
+        _log.warning('Version {} FAILED to download cleanly to {}', version, newdir)
         return False
 
-    def _download_all_files(self, version, sub_dir=''):
+    def _download_all_files_steps(self, version):
         ret_status = True   # return status: assume that nothing fails
-        
-        # root_url = self.github_repo + '/contents/' + self.github_src_dir + self.main_dir + sub_dir
-        url = 'https://api.github.com/repos/{}/contents/{}{}{}?ref=refs/tags/{}'.format(self.github_repo, self.github_src_dir, self.main_dir, sub_dir, version)
-        print(" download URL " + url)
-        gc.collect() 
-        with self.requests.get(url) as file_list:
-            file_list_json = file_list.json()
-            # print("json: "); print(file_list_json)
-            for file in file_list_json:
-                # print("file is ") ; print(file)
-                fname = file['path']
-                # print("Download " + fname )
-                path = self.modulepath(self.new_version_dir + '/' + file['path'].replace(self.main_dir + '/', '').replace(self.github_src_dir, ''))
-                if file['type'] == 'file':
-                    gitPath = file['path']
-                    print('Downloading: ', gitPath, 'to', path)
-                    if not self._download_file(version, gitPath, path):
-                        ret_status = False
-                elif file['type'] == 'dir':
-                    print('Creating dir', path)
-                    if self.mkdir(path):
-                        if not self._download_all_files(version, sub_dir + '/' + file['name']) :
-                            ret_status = False
-                        
-                gc.collect()
-
-        file_list.close()
+
+        with self._telemetry.phase('listing'):
+            entries = self._list_release_files(version)
+            if entries is not None and self.manifest_key and not (yield from self._apply_signed_manifest(version, entries)):
+                entries = None
+        if entries is None:
+            return False    # could not get the file list
+
+        # Anything already in new_version_dir belongs to this version (other versions are
+        # discarded by _create_new_version_file) and was written front to back, so a file
+        # on flash is a finished file or a prefix of one we can continue with a Range request.
+        (done, partial, complete) = self._read_journal()
+        if done or partial:
+            _log.info('Resuming: {} files done, {} partial', len(done), len(partial))
+
+        prefix = self.github_src_dir + self.repo_dir + '/'
+        for file in entries:    # parent directories are always listed before their contents
+            relPath = file['path'][len(prefix):]
+            path = self._staging_path() + '/' + relPath
+            if file['type'] == 'file':
+                if relPath in done:
+                    continue
+                gitPath = file['path']
+                if self._planned('mode', 'delta' if self.delta_update else 'full') == 'delta' and self._carry_over_if_unchanged(file, relPath, path):
+                    self._journal('done', relPath)
+                    gc.collect()
+                    yield
+                    continue
+                with self._telemetry.phase('file', relPath):
+                    downloaded = self.patches_asset and (yield from self._patch_file_steps(version, file, relPath, path))
+                    if downloaded:
+                        self._journal('done', relPath)
+                    else:
+                        downloaded = yield from self._download_with_retries_steps(version, gitPath, path, relPath,
+                                                                                 file.get('size'), file.get('sha'))
+                if not downloaded:
+                    ret_status = False
+            elif file['type'] == 'dir':
+                _log.debug('Creating dir {}', path)
+                self.mkdir(path)
+            gc.collect()
+            yield
+
         return ret_status
 
+    def _download_with_retries_steps(self, version, gitPath, path, relPath, size, sha=None):
+        if self.verify and not sha:
+            _log.warning('No SHA to verify {} against', gitPath)
+            return False
+        for attempt in range(1 + self.download_retries):
+            offset = self._file_size(path)
+            if size and offset == size:
+                if not self.verify or self._git_blob_sha(path) == sha:
+                    _log.debug('Already downloaded: {}', path)
+                    self._journal('done', relPath)
+                    return True
+                offset = 0    # complete but wrong: download it again
+            if size is None or offset > size:
+                offset = 0    # cannot tell what is there, start again
+            if offset:
+                _log.debug('Resuming: {} at {} to {}', gitPath, offset, path)
+            else:
+                _log.debug('Downloading: {} to {}', gitPath, path)
+            if (yield from self._download_file_steps(version, gitPath, path, offset, size, sha)):
+                self._journal('done', relPath)
+                return True
+            self._journal('part', relPath, self._file_size(path))
+        return False
+
+    def _read_journal(self):    # -> (set of finished paths, {path: offset} of interrupted ones,
+                                #     True once the whole version is staged)
+        section = self._dir_state()
+        return (set(section['done']), dict(section['part']), section['complete'])
+
+    def _journal(self, state, relPath=None, offset=None):
+        # Progress goes into the state record, which is saved at most every JOURNAL_SAVE_MS
+        # rather than once per file. A file finished since the last save is found on flash
+        # by the next run and checked against its size and SHA again.
+        section = self._dir_state()
+        if state == 'complete':
+            section['complete'] = True
+        elif state == 'done':
+            section['done'].append(relPath)
+            section['part'].pop(relPath, None)
+        elif state == 'bundle':    # relPath: the asset, offset: its unpacker's mark
+            section['bundle'] = [relPath] + offset
+        else:
+            section['part'][relPath] = offset
+        self._state.dirty = True
+        if state == 'complete' or _ticks_ms() - self._state.saved_ms >= JOURNAL_SAVE_MS:
+            self._state.save()
+
+    def _clear_journal(self):
+        section = self._dir_state()
+        (section['done'], section['part'], section['complete'], section['bundle']) = ([], {}, False, None)
+        self._state.dirty = True
+        self._state.save()
+
+    def _pending_version(self):    # tag being staged in new_version_dir, or None
+        pending = self._dir_state()['pending']
+        return pending if pending is not None and self._exists_dir(self.modulepath(self.new_version_dir)) else None
+
+    def _set_pending(self, version):    # start staging version (None: nothing staged) with an empty journal
+        self._dir_state()['pending'] = version
+        self._clear_journal()
+
+    def _set_installed(self, version):
+        self._dir_state()['version'] = version
+        self._set_pending(None)
+
+    def _state_record(self):
+        return self._state.load(self._legacy_state)
+
+    def _dir_state(self):    # the part of the state record for main_dir: versions and download journal
+        dirs = self._state_record()['dirs']
+        if self.main_dir not in dirs:
+            dirs[self.main_dir] = self._legacy_dir_state()
+            self._state.dirty = True
+            self._state.save()
+        elif not self._state_checked:
+            self._state_checked = True
+            self._check_installed(dirs[self.main_dir])
+        return dirs[self.main_dir]
+
+    def _check_installed(self, section):
+        # The record can fall behind the tree. Power can fail after the pending version is
+        # moved into place (or its slot is activated) but before the record says so, and the
+        # host can rewrite main_dir over USB (see boot.py). The tree's own version file tells:
+        # without this the next run would install the same release again, or skip one.
+        tree = self.get_version(self._main_path(), self.new_version_file)
+        pending = section['pending']
+        if pending is not None and tree == pending:
+            if not self.slots and self._exists_dir(self.modulepath(self.new_version_dir)):
+                return    # not moved into place yet (or only partly copied)
+            _log.info('Version {} was installed, recording it', pending)
+            self._set_installed(pending)
+        elif tree != section['version']:
+            _log.info('{} holds version {}, not {}: recording it', self._main_path(), tree, section['version'])
+            section['version'] = tree
+            self._state.dirty = True
+            self._state.save()
+
+    def _legacy_state(self):    # the state record, from the files used before .ota_state
+        record = {'dirs': {}, 'etag': None, 'latest': None, 'check': None, 'components': {}, 'rename': None}
+        lines = self._legacy_lines(self.release_cache_file)
+        if len(lines) >= 2:
+            (record['etag'], record['latest']) = lines[:2]
+        lines = self._legacy_lines(self.schedule_file)
+        try:
+            record['check'] = [int(lines[0]), int(lines[1]), lines[2], int(lines[3])]
+        except (IndexError, ValueError):
+            pass    # never checked
+        for line in self._legacy_lines(self.components_file):
+            words = line.split()
+            if len(words) == 3:
+                record['components'][words[0]] = words[1:]
+        return record
+
+    def _legacy_dir_state(self):
+        newdir = self.modulepath(self.new_version_dir)
+        pending = self.get_version(newdir, self.new_version_file) if self._exists_dir(newdir) else None
+        section = {'version': self.get_version(self._main_path(), self.new_version_file),
+                   'pending': pending, 'done': [], 'part': {}, 'complete': False, 'bundle': None}
+        for line in self._legacy_lines(self._staging_path() + '/' + self.journal_file):
+            words = line.split()
+            try:
+                if words == ['complete']:
+                    section['complete'] = True
+                elif len(words) >= 2 and words[0] == 'done':
+                    section['done'].append(words[1])
+                    section['part'].pop(words[1], None)
+                elif len(words) >= 3 and words[0] == 'part':
+                    section['part'][words[1]] = int(words[2])
+            except ValueError:
+                pass
+        return section
+
+    def _legacy_lines(self, name):    # lines of an old state file, which goes once the record is saved
+        path = name if '/' in name else self.modulepath(name)
+        try:
+            with open(path) as f:
+                lines = f.read().split('\n')
+        except OSError:
+            return []
+        self._state.legacy.append(path)
+        return lines
+
+    @staticmethod
+    def _file_size(path) -> int:
+        try:
+            return os.stat(path)[6]
+        except OSError:
+            return 0
+
+    def _download_compiled_steps(self, version):
+        # Precompiled .mpy bundle for this firmware's bytecode version (see tools/build_release.py)
+        mpy = self._mpy_version()
+        if not (yield from self._download_bundle_steps(version, self.compiled_asset.format(mpy))):
+            return False
+        built_for = self._read_manifest().get('mpy_version')
+        if built_for != mpy:
+            _log.warning('Bundle was compiled for bytecode version {}, this firmware loads {}', built_for, mpy)
+            return False
+        return True
+
+    @staticmethod
+    def _mpy_version():    # .mpy bytecode version this firmware loads, None if it does not say
+        import sys
+        mpy = getattr(sys.implementation, '_mpy', None)
+        return None if mpy is None else mpy & 0xFF
+
+    def _read_manifest(self) -> dict:    # .manifest.json written into bundles by tools/build_release.py
+        from .ota_manifest import _read_manifest
+        return _read_manifest(self)
+
+    def _load_manifest(self):    # -> {path: {'size', 'sha'}} from the staged manifest, None if unusable
+        from .ota_manifest import _load_manifest
+        return _load_manifest(self)
+
+    def _apply_signed_manifest(self, version, entries):    # steps; take file SHAs from the signed manifest
+        from .ota_manifest import _apply_signed_manifest
+        return _apply_signed_manifest(self, version, entries)
+
+    def _restart_staging(self, version):    # throw away what was staged and start this version again
+        self._rmtree(self._staging_path())
+        newdir = self.modulepath(self.new_version_dir)
+        if self._exists_dir(newdir):
+            self._rmtree(newdir)
+        self._create_new_version_file(version)
+
+    def _download_bundle_steps(self, version, name):
+        # One request for the whole release: unpack the bundle asset into new_version_dir as it arrives.
+        # After a dropped connection (in this run or an earlier one) an uncompressed bundle goes on
+        # with a Range request from the unpacker's last mark rather than from the first byte again;
+        # a compressed one cannot be entered in the middle and starts over.
+        asset = self._find_release_asset(version, name)
+        if not asset:
+            _log.warning('Release {} has no asset named {}', version, name)
+            return False
+        compressed = self._compressed_bundle(name)
+        if not self._can_unpack(name):
+            _log.warning('This firmware cannot inflate {}', name)
+            return False
+
+        from .ota_tar import _TarUnpacker
+        newdir = self._staging_path()
+        _log.info('Downloading bundle {} ({} bytes) to {}', name, asset.get('size'), newdir)
+        for attempt in range(1 + self.download_retries):
+            unpacker = _TarUnpacker(self, newdir, None if compressed else self._bundle_mark(name))
+            if (yield from self._fetch_bundle_steps(asset, name, compressed, unpacker)):
+                break
+        else:
+            return False    # every attempt failed
+        if not unpacker.finish():
+            return False
+        _log.info('Unpacked {} files from {}', unpacker.files, name)
+        if self.verify and unpacker.manifest is None and unpacker.checked:
+            unpacker.manifest = self._load_manifest()    # resumed after the last member that needed it
+        if self.verify and unpacker.checked != len(unpacker.manifest or ()):
+            _log.warning('Bundle does not hold every file in its manifest')
+            return False
+        if unpacker.bad:
+            if self._read_manifest().get('mpy_version') is not None:
+                return False    # compiled files are not in the repo to fetch one by one
+            for relPath in unpacker.bad:    # fetch just those again, from the repo
+                info = unpacker.manifest[relPath]
+                gitPath = self.github_src_dir + self.repo_dir + '/' + relPath
+                if not (yield from self._download_with_retries_steps(version, gitPath, newdir + '/' + relPath,
+                                                                    relPath, info['size'], info['sha'])):
+                    return False
+        return True
+
+    def _fetch_bundle_steps(self, asset, name, compressed, unpacker) -> bool:    # False: worth another attempt
+        if unpacker.done:
+            return True    # nothing left to fetch (or the resume failed): finish() tells
+        headers = {'Accept': 'application/octet-stream'}    # asset content, not its JSON description
+        if unpacker.offset:
+            headers['Range'] = 'bytes={}-'.format(unpacker.offset)
+            _log.info('Resuming bundle {} at byte {}', name, unpacker.offset)
+        mark = unpacker.mark
+        gc.collect()
+        try:
+            with self._http_get(asset['url'], headers) as bundle:
+                code = bundle.status_code
+                if ((code < 200) or (code > 299)):
+                    _log.warning('Bad status {} from {}', code, asset['url'])
+                    yield from self._drain_steps(bundle)
+                    unpacker.close()
+                    return False
+                if unpacker.offset and code != 206:
+                    unpacker.close()
+                    unpacker.start()    # server sent the whole bundle after all
+                pieces = bundle.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE)
+                if compressed:
+                    from .ota_inflate import _Inflater
+                    pieces = _Inflater(pieces, name.endswith('.gz')).pieces(self._inflate_buffer())
+                for chunk in pieces:
+                    unpacker.feed(chunk)
+                    if unpacker.mark is not mark and not compressed:
+                        mark = unpacker.mark
+                        self._journal('bundle', name, mark)
+                    if unpacker.done:
+                        break
+                    yield
+                yield from self._drain_steps(bundle)    # padding after the end-of-archive blocks
+        except Exception as e:
+            _log.warning('Cannot get data from {}: {}', asset['url'], e)
+            unpacker.close()
+            return False
+        if unpacker.incomplete():
+            unpacker.close()
+            _log.warning('Bundle {} stopped at byte {}', name, unpacker.offset)
+            return False
+        return True
+
+    @staticmethod
+    def _compressed_bundle(name) -> bool:    # e.g. app.tar.zlib
+        return name.endswith('.zlib') or name.endswith('.gz')
+
+    def _can_unpack(self, name) -> bool:    # False for a compressed bundle the firmware cannot inflate
+        return not self._compressed_bundle(name) or self._can_inflate()
+
+    @staticmethod
+    def _can_inflate() -> bool:    # whether this firmware can decompress a stream (ota_inflate)
+        from .ota_inflate import _Inflater
+        return _Inflater.available()
+
+    def _bundle_mark(self, name):    # where an earlier attempt at bundle name got to, or None
+        mark = self._dir_state().get('bundle')
+        return mark[1:] if mark and mark[0] == name else None
+
+    def _find_release_asset(self, version, name):
+        # the API asset url (rather than browser_download_url) also works for private repos
+        if self._release_assets is None or self._release_assets[0] != version:
+            url = 'releases/tags/{}'.format(version)
+            try:
+                with self._api_get(url) as release:
+                    assets = {}
+                    for asset in release.json().get('assets', []):
+                        assets[asset['name']] = {'url': asset['url'], 'size': asset.get('size', 0)}
+            except Exception as e:
+                _log.warning('Cannot get release {} from {}: {}', version, url, e)
+                return None
+            self._release_assets = (version, assets)
+        return self._release_assets[1].get(name)
+
+    def _list_release_files(self, version):
+        # Flat list of everything below github_src_dir/repo_dir at the release tag,
+        # each entry a small dict with path, type ('file' or 'dir'), sha and size.
+        if self._listing is not None and self._listing[0] == version:
+            return self._listing[1]    # already listed while planning
+        entries = self._list_release_files_uncached(version)
+        if entries is not None:
+            self._listing = (version, entries)
+        return entries
+
+    def _list_release_files_uncached(self, version):
+        entries = []
+        if self.listing == 'tree':
+            if self._list_git_tree(version, entries):
+                return entries
+            _log.warning('Falling back to contents listing')
+            entries = []
+        if self._list_contents(version, '', entries):
+            return entries
+        return None
+
+    def _list_git_tree(self, version, entries) -> bool:
+        # One request for the whole release, instead of one /contents/ request per directory
+        url = 'git/trees/{}?recursive=1'.format(version)
+        _log.debug('listing URL {}', url)
+        prefix = self.github_src_dir + self.repo_dir + '/'
+        gc.collect()
+        try:
+            with self._api_get(url) as tree_list:
+                tree_json = tree_list.json()
+        except Exception as e:
+            _log.warning('Cannot get file tree from {}: {}', url, e)
+            return False
+        if tree_json.get('truncated') or 'tree' not in tree_json:
+            _log.warning('File tree for {} is incomplete', version)
+            return False
+        for item in tree_json['tree']:
+            if item['path'].startswith(prefix):
+                entries.append({
+                    'path': item['path'],
+                    'name': item['path'].split('/')[-1],
+                    'type': 'dir' if item['type'] == 'tree' else 'file',
+                    'sha':  item.get('sha'),
+                    'size': item.get('size', 0),
+                })
+        del tree_json
+        gc.collect()
+        return True
+
+    def _list_contents(self, version, sub_dir, entries) -> bool:
+        # root_url = self.github_repo + '/contents/' + self.github_src_dir + self.repo_dir + sub_dir
+        url = 'contents/{}{}{}?ref=refs/tags/{}'.format(self.github_src_dir, self.repo_dir, sub_dir, version)
+        _log.debug('listing URL {}', url)
+        gc.collect() 
+        try:
+            with self._api_get(url) as file_list:
+                file_list_json = file_list.json()
+        except Exception as e:
+            _log.warning('Cannot get file list from {}: {}', url, e)
+            return False
+        for file in file_list_json:
+            entries.append({
+                'path': file['path'],
+                'name': file['name'],
+                'type': file['type'],
+                'sha':  file.get('sha'),
+                'size': file.get('size', 0),
+            })
+            if file['type'] == 'dir':
+                if not self._list_contents(version, sub_dir + '/' + file['name'], entries):
+                    return False
+        return True
+
     
 
-    def _download_file(self, version, gitPath, path):
-        git_file_url = 'https://raw.githubusercontent.com/{}/{}/{}'.format(self.github_repo, version, gitPath)
+    def _buffer(self):
+        # every download, copy and hash shares one preallocated sector buffer
+        if self._sector_buf is None:
+            self._sector_buf = bytearray(FLASH_SECTOR_SIZE)
+        return self._sector_buf
+
+    def _inflate_buffer(self):    # output of the decompressor, on its way to the sector writer
+        if self._inflate_buf is None:
+            self._inflate_buf = bytearray(DOWNLOAD_CHUNK_SIZE)
+        return self._inflate_buf
+
+    def _sector_writer(self, path, mode='wb', blob=None):
+        return _SectorWriter(self._buffer(), path, mode, blob)
+
+    def _hash_prefix(self, blob, path, length) -> bool:    # feed the first length bytes of path to blob
+        buf = self._buffer()
+        try:
+            with open(path, 'rb') as f:
+                while length:
+                    n = f.readinto(buf)
+                    if not n:
+                        return False
+                    n = min(n, length)
+                    blob.update(memoryview(buf)[:n])
+                    length -= n
+        except OSError:
+            return False
+        return True
+
+    def _carry_over_if_unchanged(self, file, relPath, path) -> bool:
+        # Delta mode: the GitHub listing carries the git blob SHA of every file,
+        # so if the installed copy hashes the same we copy it from local flash
+        # into new_version_dir instead of downloading it again.
+        installedPath = self._main_path() + '/' + relPath
+        unchanged = self._planned('unchanged', None)    # already hashed while planning
+        if unchanged is not None:
+            same = relPath in unchanged
+        else:
+            same = self._installed_sha(installedPath) == file.get('sha')
+        if not same:
+            return False    # changed, new or unreadable: download it
+        _log.debug('Unchanged: {} to {}', installedPath, path)
+        return self._copy_file(installedPath, path)
+
+    def _installed_sha(self, path):    # _git_blob_sha(), remembering the last answer for the next check
+        if self._last_hash[0] != path:
+            self._last_hash = (path, self._git_blob_sha(path))
+        return self._last_hash[1]
+
+    def _patch_buffer(self):
+        if self._patch_buf is None:
+            self._patch_buf = bytearray(DOWNLOAD_CHUNK_SIZE)
+        return self._patch_buf
+
+    def _patch_index(self, version):    # -> {path: entry} of tools/make_patches.py's patches.json
+        if self._patches is None or self._patches[0] != version:
+            index = {}
+            asset = self._find_release_asset(version, self.patches_asset)
+            if asset:
+                try:
+                    with self._http_get(asset['url'], {'Accept': 'application/octet-stream'}) as response:
+                        if response.status_code == 200:
+                            found = response.json()
+                            if found.get('to') == version:
+                                index = found.get('files', {})
+                        else:
+                            self._drain(response)
+                except Exception as e:
+                    _log.warning('Cannot get patch index from {}: {}', asset['url'], e)
+            self._patches = (version, index)
+        return self._patches[1]
+
+    def _patch_file_steps(self, version, file, relPath, path):
+        # Rebuild a changed file from the installed copy when the release has a patch made
+        # from exactly that copy. The result is hashed on its way to flash like a download;
+        # anything unexpected returns False and the file is downloaded in full instead.
+        entry = self._patch_index(version).get(relPath)
+        if not entry or entry.get('sha') != file.get('sha'):
+            return False
+        installedPath = self._main_path() + '/' + relPath
+        if self._installed_sha(installedPath) != entry['base']:
+            return False    # not the release the patch was made from
+        asset = self._find_release_asset(version, entry['patch'])
+        if not asset:
+            return False
+        _log.debug('Patching: {} to {} with {} bytes', installedPath, path, entry['patch_size'])
+        patcher = None
+        try:
+            with open(installedPath, 'rb') as base:
+                writer = self._sector_writer(path, 'wb', _blob_hash(entry['size']))
+                try:
+                    from .ota_patch import _Patcher
+                    patcher = _Patcher(base, writer, self._patch_buffer())
+                    with self._http_get(asset['url'], {'Accept': 'application/octet-stream'}) as response:
+                        if response.status_code != 200:
+                            _log.warning('Bad status {} from {}', response.status_code, asset['url'])
+                            patcher.ok = False
+                        else:
+                            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                                patcher.feed(chunk)
+                                if patcher.done:
+                                    break
+                                yield
+                        yield from self._drain_steps(response)
+                finally:
+                    writer.close()
+        except Exception as e:
+            _log.warning('Cannot patch {}: {}', installedPath, e)
+            patcher = None
+        if patcher and patcher.done and patcher.ok and writer.written == entry['size'] and writer.sha() == file.get('sha'):
+            return True
+        _log.info('Patch for {} did not apply, downloading it', relPath)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return False
+
+    def _git_blob_sha(self, path):    # same id git uses: sha1 of "blob <size>\0" + content
+        try:
+            size = os.stat(path)[6]
+        except OSError:
+            return None    # not installed
+        blob = _blob_hash(size)
+        if not self._hash_prefix(blob, path, size):
+            return None
+        return _blob_sha(blob)
+
+    def _download_file_steps(self, version, gitPath, path, offset=0, size=None, sha=None):
+        git_file_url = '{}/{}'.format(version, gitPath)
         # with self.requests.get('https://raw.githubusercontent.com/{}/{}/{}'.format(self.github_repo, version, gitPath), saveToFile=path) as file_data:
+        if offset:
+            headers = {'Range': 'bytes={}-'.format(offset)}    # continue in plain bytes
+        elif self._planned('compressed', self.compressed) and self._can_inflate():
+            headers = {'Accept-Encoding': 'gzip, deflate'}
+        else:
+            headers = None
         try:
-            with self.requests.get( git_file_url ) as file_data :
+            with self._raw_get(git_file_url, headers) as file_data :
                 #file_data.raise_for_status()     # notice bad responses
                 # raise_for_status() not working with GitHub(?):
                 # always get exception :
                 #  'Response' object has no attribute 'raise_for_status'
                 code = file_data.status_code
                 if ((code < 200) or (code > 299)):
-                        print(f"Bad status {code} from {git_file_url}")
+                        _log.warning('Bad status {} from {}', code, git_file_url)
+                        yield from self._drain_steps(file_data)
                         file_data.close()
                         return False
+                if code != 206:
+                    offset = 0    # server sent the whole file after all
                    
 
-                # save file_data into saveToFile=path, formerly done by httpclient.get in micropython version
-                # TODO - get file content into file, or see if adafruit request.get() can do the same
-                ######################## TODO #################################
-                # We open file as binary in case the content is not text (e.g. a compiled library)
-                # and hope that it is legitimate to copy text this way too,
-                # rather than as file_data.text 
+                # save file_data into path as it arrives, rather than via file_data.content,
+                # so a large file (e.g. a compiled library) never has to fit in the heap.
+                # We open file as binary in case the content is not text.
+                # Hash the file on its way to flash rather than reading it back afterwards;
+                # only when continuing a partial file is its start read again
+                blob = None
+                if self.verify and sha and size is not None:
+                    blob = _blob_hash(size)
+                    if offset and not self._hash_prefix(blob, path, offset):
+                        yield from self._drain_steps(file_data)
+                        return False
                 try:
-                    with open(path, "wb") as file :
-                        # file.raise_for_status()    # notice bad file opens
-                        # raise_for_status() not working with files?
-                        # always get exception : 
-                        #  'FileIO' object has no attribute 'raise_for_status'
-                        file.write(file_data.content)
-                    
-                    print("\tCopied file " + path)
+                    writer = self._sector_writer(path, 'ab' if offset else 'wb', blob)
                 except Exception as f: 
-                    print(f"A file could not be opened : {f}")
+                    _log.warning('A file could not be opened : {}', f)
+                    yield from self._drain_steps(file_data)
                     return False
+                try:
+                    pieces = file_data.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE)
+                    encoding = file_data.headers.get('content-encoding')
+                    if encoding in ('gzip', 'deflate'):    # 'deflate' is zlib wrapped
+                        from .ota_inflate import _Inflater
+                        pieces = _Inflater(pieces, encoding == 'gzip').pieces(self._inflate_buffer())
+                    for chunk in pieces:
+                        writer.write(chunk)
+                        yield
+                finally:
+                    writer.close()    # keeps what arrived, for the next attempt to continue from
+                if size is not None and offset + writer.written != size:
+                    _log.warning('Expected {} bytes for {}, got {}', size, path, offset + writer.written)
+                    return False
+                if blob and writer.sha() != sha:
+                    _log.warning('{} does not match its SHA {}, discarding it', path, sha)
+                    os.remove(path)    # the next attempt starts from scratch
+                    return False
+                _log.debug('Copied file {}', path)
 
         except Exception as e:
-                print(f"Cannot get data from {git_file_url}: {e}")
+                _log.warning('Cannot get data from {}: {}', git_file_url, e)
                 return False
 
         return True
@@ -366,158 +2184,140 @@ class OTAUpdater:
             # main_dir not part of path to secrets, nothing to do
             return True
 
-        # copy secrets file into new_version_dir
-        fromPath = self.modulepath(self.secrets_file)  # filename should include path
-        toPath = self.modulepath(self.new_version_dir + '/' + self.secrets_file)             
+        # copy secrets file into new_version_dir, at the same place relative to main_dir
+        relPath = '/'.join(words[words.index(self.main_dir) + 1:])
+        fromPath = self._main_path() + '/' + relPath
+        toPath = self._staging_path() + '/' + relPath
             
-        print('Copying secrets file from {} to {}'.format(fromPath, toPath))
+        _log.debug('Copying secrets file from {} to {}', fromPath, toPath)
         if self._copy_file(fromPath, toPath):
-            print('Copied secrets file from {} to {}'.format(fromPath, toPath))
+            _log.info('Copied secrets file from {} to {}', fromPath, toPath)
             return True
 
         return False    # failed to copy secrets
 
     
 
+    def _main_path(self):    # where the running version is installed
+        slot = self._active_slot()
+        return self.modulepath(slot + '/' + self.main_dir if slot else self.main_dir)
+
+    def _staging_path(self):    # where the next version is downloaded
+        if self.slots:
+            return self.modulepath(self._inactive_slot() + '/' + self.main_dir)
+        return self.modulepath(self.new_version_dir)
+
+    def _active_slot(self):
+        # None until the first slot install: the running version is still at /<main_dir>
+        if not self.slots:
+            return None
+        slot = OTAUpdater.read_slot_pointer(self.modulepath(self.slot_file))
+        return slot if slot in self.slots else None
+
+    def _inactive_slot(self):
+        return self.slots[1] if self._active_slot() == self.slots[0] else self.slots[0]
+
+    @staticmethod
+    def read_slot_pointer(pointer):
+        """Name of the active slot from the pointer file, or None. Cheap enough for code.py."""
+        for name in (pointer, pointer + '.new'):    # .new only survives an interrupted switch
+            try:
+                with open(name) as f:
+                    return f.read().strip() or None
+            except OSError:
+                pass
+        return None
+
+    def _activate_slot(self, slot) -> bool:
+        # The switch is one tiny file. It is written beside the pointer and then renamed
+        # over it; if power fails between the remove and the rename, read_slot_pointer
+        # finds the .new file, so either the old or the new slot is always bootable.
+        pointer = self.modulepath(self.slot_file)
+        _log.info('Activating slot {}', slot)
+        try:
+            with open(pointer + '.new', 'w') as f:
+                f.write(slot)
+            try:
+                os.remove(pointer)    # FAT will not rename over an existing file
+            except OSError:
+                pass
+            os.rename(pointer + '.new', pointer)
+        except OSError as e:
+            _log.warning('Cannot switch {} to {}: {}', pointer, slot, e)
+            return False
+        self._rmtree(self.modulepath(self.new_version_dir))    # update no longer pending
+        _log.info('Update installed in {}, please reboot now', slot)
+        return True
+
     def _delete_old_version(self):
         retStat = True        # assume good return status
-        print('Deleting old version at {} ...'.format(self.modulepath(self.main_dir)))
+        if not self._exists_dir(self.modulepath(self.main_dir)):
+            return True    # e.g. a component installed for the first time
+        _log.info('Deleting old version at {} ...', self.modulepath(self.main_dir))
         if self._rmtree(self.modulepath(self.main_dir)):
             action = "Deleted"
         else:
             action = "FAILED to delete"
             retStat = False
             
-        print('{} old version at {} ...'.format(action,self.modulepath(self.main_dir)))   
+        _log.info('{} old version at {} ...', action, self.modulepath(self.main_dir))   
         return retStat
 
     
     def _install_new_version(self):
         retStat = True
-        print('Installing new version at {} ...'.format(self.modulepath(self.main_dir)))
+        _log.info('Installing new version at {} ...', self.modulepath(self.main_dir))
         if self._os_supports_rename():
             try:
                 os.rename(self.modulepath(self.new_version_dir), self.modulepath(self.main_dir))
             except:
-                print("Unable to rename {} as {}".format(self.modulepath(self.new_version_dir), self.modulepath(self.main_dir)))
+                _log.warning('Unable to rename {} as {}', self.modulepath(self.new_version_dir), self.modulepath(self.main_dir))
                 retStat = False
         else:
             if not self._copy_directory(self.modulepath(self.new_version_dir), self.modulepath(self.main_dir)):
-                print("Cannot copy {} to {}".format(self.modulepath(self.new_version_dir), self.modulepath(self.main_dir)))
+                _log.warning('Cannot copy {} to {}', self.modulepath(self.new_version_dir), self.modulepath(self.main_dir))
                 retStat = False
             else:    
                 if not self._rmtree(self.modulepath(self.new_version_dir)):
                     retStat = False 
         if retStat :
-            print('Update installed, please reboot now')
+            _log.info('Update installed, please reboot now')
         else:
-            print('   UPDATE FAILED: DO NOT REBOOT WITHOUT EXAMINING SYSTEM ')
+            _log.error('   UPDATE FAILED: DO NOT REBOOT WITHOUT EXAMINING SYSTEM ')
             
         return retStat
         
 
     def _rmtree(self, directory):
-        retStat = True    # assume good return status
-        print("Enter _rmtree " + directory)
         if not directory:
             return True    # nothing to remove, pretend
-        for entry in os.listdir(directory):
-              entryPath = directory + "/" + entry
-              Path = adafruit_pathlib.Path(entryPath)
-              if Path.is_dir() :
-                    print("  Call rmtree " + entryPath )
-                    if not self._rmtree(entryPath):
-                        retStat = False
-                        print("FAILED to rmtree " + entryPath)
-              else:
-                  print("   Call remove " + entryPath )
-                  try:
-                      os.remove(entryPath)
-                  except:
-                    retStat = False
-                    print("FAILED to remove " + entryPath)
-                      
-        try:
-            os.rmdir(directory)
-        except:
-            retStat = False
-            print("FAILED to _rmtree " + directory)
-
-        return retStat
-
-    
-      
-
-    def _os_supports_rename(self) -> bool:
-        self._mk_dirs('otaUpdater/osRenameTest')
-        os.rename('otaUpdater', 'otaUpdated')
-        result = len(os.listdir('otaUpdated')) > 0
-        self._rmtree('otaUpdated')
-        return result
+        return self._tree.remove_tree(directory)
+
+    def _os_supports_rename(self) -> bool:    # tried once, the answer is kept in the state record
+        record = self._state_record()
+        if record['rename'] is None:
+            self._mk_dirs('otaUpdater/osRenameTest')
+            os.rename('otaUpdater', 'otaUpdated')
+            record['rename'] = len(os.listdir('otaUpdated')) > 0
+            self._rmtree('otaUpdated')
+            self._state.dirty = True
+            self._state.save()
+        return record['rename']
 
     def _copy_directory(self, fromPath, toPath):
-        if not self._exists_dir(toPath):
-            if not self._mk_dirs(toPath):
-                return False
+        return self._tree.copy_tree(fromPath, toPath)
 
-        for entry in os.listdir(fromPath):
-            is_dir = entry[1] == 0x4000
-            if is_dir:
-                self._copy_directory(fromPath + '/' + entry[0], toPath + '/' + entry[0])
-            else:
-                self._copy_file(fromPath + '/' + entry[0], toPath + '/' + entry[0])
-
-
-    
     def _copy_file(self, fromPath, toPath):
-        retStat = True    # good return status until proven otherwise
-        try:
-            with open(fromPath) as fromFile:
-                try:
-                    with open(toPath, 'w') as toFile:
-                        CHUNK_SIZE =     512 # bytes
-                        data = fromFile.read(CHUNK_SIZE)
-                        try:
-                            while data:
-                                toFile.write(data)
-                                data = fromFile.read(CHUNK_SIZE)
-                        except:
-                            print("Could not write data into " + toPath)
-                            retStat = False
-                    
-                except:
-                    print("Could not open target file " + toPath)
-                    retStat = False
-            
-        except:
-            print("Could not open source file " + fromPath)
-            retStat = False
-
-        return retStat
-        
+        return self._tree.copy_file(fromPath, toPath)
 
-    
     def _exists_dir(self, path) -> bool:
-        try:
-            os.listdir(path)
-            return True
-        except:
-            return False
+        return self._tree.is_dir(path)
 
     def _mk_dirs(self, path:str):
-        paths = path.split('/')
-
-        pathToCreate = ''
-        for x in paths:
-            self.mkdir(pathToCreate + x)
-            pathToCreate = pathToCreate + x + '/'
-
+        return self._tree.mkdirs(path)
 
     def mkdir(self, path:str):
-        if not self._exists_dir(path) :
-            os.mkdir(path)
-        
-
+        return self._tree.mkdirs(path)    # callers test the result before descending into path
 
     def modulepath(self, path):
         return self.module + '/' + path if self.module else path
@@ -0,0 +1,33 @@
+# Timer wake bookkeeping for OTAUpdater.check_after_wake(), only used on the
+# deep sleep path
+
+
+class _WakeRecord:
+    """
+    What check_after_wake() keeps between timer wakes, in alarm.sleep_memory rather than
+    flash: it survives deep sleep (not a reset or power loss) and costs no flash writes.
+    Checks made, failed checks in a row, whether the last one found a new version, and how
+    long the radio was on for the last check and for all of them.
+    """
+
+    MAGIC = b'OTW1'
+    SIZE = 20
+
+    def __init__(self, memory, offset):
+        self.memory = memory    # None without the alarm module: nothing is kept
+        self.offset = offset
+        data = bytes(memory[offset:offset + self.SIZE]) if memory is not None else b''
+        valid = data[:4] == self.MAGIC
+        self.checks = int.from_bytes(data[4:8], 'little') if valid else 0
+        self.failures = int.from_bytes(data[8:10], 'little') if valid else 0
+        self.found = bool(data[10]) if valid else False
+        self.radio_ms = int.from_bytes(data[12:16], 'little') if valid else 0
+        self.radio_ms_total = int.from_bytes(data[16:20], 'little') if valid else 0
+
+    def save(self):
+        if self.memory is None:
+            return
+        self.memory[self.offset:self.offset + self.SIZE] = (
+            self.MAGIC + self.checks.to_bytes(4, 'little') + min(self.failures, 0xFFFF).to_bytes(2, 'little')
+            + bytes((int(self.found), 0)) + self.radio_ms.to_bytes(4, 'little')
+            + (self.radio_ms_total & 0xFFFFFFFF).to_bytes(4, 'little'))
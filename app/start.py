@@ -5,7 +5,9 @@ print("Hello World!")
 import os
 from time import sleep
 
-f = open("app/.version")
+# .version is beside this file: in /app, or in <slot>/app when OTAUpdater(slots=...) is used
+# (code.py puts the active slot first on sys.path, and /app is removed after the first slot update)
+f = open(__file__.rpartition("/")[0] + "/.version")
 version = f.read()
 print("version file contains: " + version)
 sleep(5)
@@ -9,6 +9,25 @@
 # There is also install_update_if_available_after_boot()
 # which checks to see if a pending update was noted in a previous wifi connection,
 # and does not initialize wifi if there is no indication of an available update.
+#
+# checkOnTimerWake() below is for a board that deep sleeps between update checks.
+
+def useActiveSlot():
+    # With OTAUpdater(slots=...) each release is installed in its own slot directory
+    # and /.ota_slot names the active one (.ota_slot.new only exists if power failed
+    # while switching). Put that slot first on sys.path so "import app..." loads from it.
+    # Without a pointer file, the application is still imported from /app.
+    import sys
+    for pointer in ('.ota_slot', '.ota_slot.new'):
+        try:
+            with open(pointer) as f:
+                slot = f.read().strip()
+        except OSError:
+            continue
+        if slot:
+            sys.path.insert(0, '/' + slot)
+            print('Running from slot', slot)
+        return
 
 def connectToWifiAndUpdate():
     import time,  gc
@@ -41,10 +60,32 @@ def connectToWifiAndUpdate():
         del(otaUpdater)
         gc.collect()
 
+def checkOnTimerWake():
+    # Woken by the update-check timer: probe for a new release with the radio on as briefly
+    # as possible, and go straight back to deep sleep unless there is one. Any other start
+    # (power-on, reset, a button alarm) carries on as normal. For the shortest radio-on time
+    # use WIFI_SSID/WIFI_PASSWORD rather than the CIRCUITPY_ ones in settings.toml, so the
+    # radio is not started on every wake before this runs.
+    # The application starts the cycle with OTAUpdater(...).deep_sleep_until_next_check().
+    import alarm
+    if not isinstance(alarm.wake_alarm, alarm.time.TimeAlarm):
+        return
+    from app.ota_updater import OTAUpdater
+    settings = OTAUpdater.get_misc_settings()
+    otaUpdater = OTAUpdater(settings = settings, github_repo = None)
+    if otaUpdater.check_after_wake(settings["wifi_ssid"], settings["wifi_password"]):
+        return    # new version: connectToWifiAndUpdate() installs it
+    import board
+    # pressing D1 (HIGH when pressed) still wakes the board fully
+    otaUpdater.deep_sleep_until_next_check(alarm.pin.PinAlarm(board.D1, value=True))
+
 def startApp():
     import app.start        # sorry - this assumes that most code is in app/ subdir
 
 
+useActiveSlot()
+checkOnTimerWake()    # before anything slow below: on a timer wake this usually ends in deep sleep
+
 ####################################################
 import board
 import digitalio
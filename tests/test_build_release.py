@@ -0,0 +1,40 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "tools"))
+
+import build_release  # noqa: E402
+
+
+def fake_compiler(header):
+    def compile_file(src, dst):
+        with open(dst, "wb") as f:
+            f.write(header + b"\x1f\x00bytecode")
+    return compile_file
+
+
+def test_mpy_version_micropython_header():
+    assert build_release.mpy_version(b"M\x06\x00\x1f") == 6
+
+
+def test_mpy_version_circuitpython_header():
+    # CircuitPython 7+ mpy-cross writes b'C' as the magic byte
+    assert build_release.mpy_version(b"C\x06\x00\x1f") == 6
+    assert build_release.mpy_version(b"C\x05\x00\x1f") == 5
+
+
+def test_mpy_version_rejects_other_files():
+    for data in (b"", b"C", b"#!python", b"\x00\x06"):
+        try:
+            build_release.mpy_version(data)
+        except ValueError:
+            continue
+        raise AssertionError("accepted %r" % data)
+
+
+def test_compile_tree_with_circuitpython_compiler():
+    files = {"a.py": b"x = 1\n", "sub/b.py": b"y = 2\n", "data.txt": b"text"}
+    compiled, version = build_release.compile_tree(files, fake_compiler(b"C\x06"))
+    assert version == 6
+    assert sorted(compiled) == ["a.mpy", "data.txt", "sub/b.mpy"]
+    assert compiled["data.txt"] == b"text"
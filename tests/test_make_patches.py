@@ -0,0 +1,58 @@
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "tools"))
+
+import make_patches  # noqa: E402
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+
+
+def read(path):
+    with open(os.path.join(ROOT, path), "rb") as f:
+        return f.read()
+
+
+def roundtrip(old, new):
+    patch = make_patches.make_patch(old, new)
+    assert make_patches.apply_patch(old, patch) == new
+    return patch
+
+
+def test_short_match_grown_backwards_terminates():
+    # a 16 byte match that grows back by one byte is still too short to copy
+    old = read("app/ota_updater.py")
+    roundtrip(old, b"#" + old[9:26] + b"$" * 20)
+
+
+def test_random_edits_roundtrip():
+    old = read("app/ota_updater.py")
+    rng = random.Random(1)
+    for _ in range(40):
+        new = bytearray(old)
+        for _ in range(rng.randint(1, 5)):
+            pos = rng.randrange(len(new))
+            cut = rng.randint(0, 40)
+            new[pos:pos + cut] = bytes(rng.randrange(256) for _ in range(rng.randint(0, 40)))
+        roundtrip(old, bytes(new))
+
+
+def test_small_change_gives_small_patch():
+    old = read("app/ota_updater.py")
+    new = old.replace(b"DOWNLOAD_CHUNK_SIZE = 1024", b"DOWNLOAD_CHUNK_SIZE = 2048", 1)
+    assert len(roundtrip(old, new)) < 100
+
+
+def test_edge_cases():
+    for old, new in [(b"", b""), (b"", b"new"), (b"old", b""), (b"x" * 100, b"x" * 100)]:
+        roundtrip(old, new)
+
+
+def test_apply_rejects_bad_input():
+    for patch in (b"XXXX\0", make_patches.MAGIC + b"\x07"):
+        try:
+            make_patches.apply_patch(b"", patch)
+        except ValueError:
+            continue
+        raise AssertionError("accepted %r" % patch)
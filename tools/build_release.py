@@ -0,0 +1,225 @@
+"""
+Build release assets for OTAUpdater from the main_dir tree.
+
+    python tools/build_release.py app dist/
+    python tools/build_release.py app dist/ --compiler "mpy-cross-9 {src} -o {dst}"
+    python tools/build_release.py app dist/ --compiler-module mytools:compile
+    python tools/build_release.py app dist/ --compress
+    python tools/build_release.py app dist/ --key "$OTA_MANIFEST_KEY"
+
+Writes to the output directory:
+
+    app.tar          the tree as it is, for OTAUpdater(bundle_asset='app.tar')
+    app-mpy<N>.tar   the same tree with every .py precompiled to .mpy bytecode
+                     version N, for OTAUpdater(compiled_asset='app-mpy{}.tar')
+
+Attach both to the GitHub release. Each archive starts with .manifest.json,
+which lists every file with its size and git blob SHA, plus the bytecode
+version of the compiled files (null in the source archive). OTAUpdater
+checks every file it unpacks against that SHA. The source manifest is also
+written on its own as manifest.json, for updates that download file by file.
+
+With --key each manifest is signed: an HMAC-SHA256 of its exact bytes goes
+into .manifest.sig, right after .manifest.json in the archives, and into the
+manifest.json.sig asset. Devices given the same key (OTAUpdater(manifest_key=...)
+or OTA_MANIFEST_KEY in settings.toml) install only what a signed manifest lists.
+
+With --compress each archive is also written zlib-compressed as
+app.tar.zlib and app-mpy<N>.tar.zlib; the device inflates them as they
+stream in. --window-bits sets the deflate window, which is also the RAM
+the device needs to inflate: 2**10 = 1 KiB by default, 15 for 32 KiB.
+Only MicroPython firmware (deflate.DeflateIO or zlib.DecompIO) can do that.
+CircuitPython's zlib has only the one-shot zlib.decompress(), so a
+CircuitPython device skips these archives and downloads file by file.
+
+The compiler step is pluggable because the bytecode must match the firmware:
+use the mpy-cross built for the CircuitPython version on the devices. A
+--compiler template is run through the shell with {src} and {dst} replaced;
+a --compiler-module names a Python function compile(src, dst).
+"""
+
+import argparse
+import hashlib
+import hmac
+import importlib
+import io
+import json
+import os
+import shlex
+import subprocess
+import sys
+import tarfile
+import tempfile
+import zlib
+
+from ota_common import git_blob_sha
+
+MANIFEST = ".manifest.json"
+SIGNATURE = ".manifest.sig"
+
+
+def read_tree(root):
+    """relative path -> bytes, skipping caches and the updater's own bookkeeping files."""
+    files = {}
+    for dirpath, dirnames, names in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if d != "__pycache__")
+        for name in sorted(names):
+            if name in (".version", MANIFEST, SIGNATURE) or name.endswith(".pyc"):
+                continue
+            path = os.path.join(dirpath, name)
+            with open(path, "rb") as f:
+                files[os.path.relpath(path, root).replace(os.sep, "/")] = f.read()
+    return files
+
+
+def command_compiler(template):
+    def compile_file(src, dst):
+        command = template.format(src=shlex.quote(src), dst=shlex.quote(dst))
+        subprocess.run(command, shell=True, check=True)
+    return compile_file
+
+
+def module_compiler(spec):
+    module_name, _, function_name = spec.partition(":")
+    return getattr(importlib.import_module(module_name), function_name or "compile")
+
+
+def mpy_version(data):
+    """Bytecode version from a .mpy header: b'M' (MicroPython) or b'C'
+    (CircuitPython 7 and later), version, flags, ..."""
+    if len(data) < 2 or data[0:1] not in (b"M", b"C"):
+        raise ValueError("not a .mpy file")
+    return data[1]
+
+
+def compile_tree(files, compile_file):
+    """Returns (files with .py replaced by .mpy, bytecode version)."""
+    compiled = {}
+    version = None
+    with tempfile.TemporaryDirectory() as work:
+        for path, data in files.items():
+            if not path.endswith(".py"):
+                compiled[path] = data
+                continue
+            src = os.path.join(work, "src.py")
+            dst = os.path.join(work, "out.mpy")
+            with open(src, "wb") as f:
+                f.write(data)
+            compile_file(src, dst)
+            with open(dst, "rb") as f:
+                out = f.read()
+            os.remove(dst)
+            this_version = mpy_version(out)
+            if version not in (None, this_version):
+                raise ValueError("compiler produced mixed bytecode versions")
+            version = this_version
+            compiled[path[:-3] + ".mpy"] = out
+    return compiled, version
+
+
+def manifest(files, mpy):
+    return {
+        "mpy_version": mpy,
+        "files": {path: {"size": len(data), "sha": git_blob_sha(data)} for path, data in sorted(files.items())},
+    }
+
+
+def manifest_bytes(files, mpy):
+    return json.dumps(manifest(files, mpy), separators=(",", ":")).encode()
+
+
+def sign(key, data):
+    return hmac.new(key, data, hashlib.sha256).hexdigest().encode()
+
+
+def write_bundle(path, files, mpy, key=None):
+    """ustar archive, manifest (and signature) first, directories before their contents
+    (see _TarUnpacker in app/ota_tar.py)."""
+    with tarfile.open(path, "w", format=tarfile.USTAR_FORMAT) as tar:
+        entries = [(MANIFEST, manifest_bytes(files, mpy))]
+        if key:
+            entries.append((SIGNATURE, sign(key, entries[0][1])))
+        entries += sorted(files.items())
+        seen = set()
+        for name, data in entries:
+            parts = name.split("/")
+            for i in range(1, len(parts)):
+                directory = "/".join(parts[:i])
+                if directory not in seen:
+                    seen.add(directory)
+                    info = tarfile.TarInfo("./" + directory)
+                    info.type = tarfile.DIRTYPE
+                    info.mode = 0o755
+                    tar.addfile(info)
+            info = tarfile.TarInfo("./" + name)
+            info.size = len(data)
+            info.mode = 0o644
+            tar.addfile(info, io.BytesIO(data))
+
+
+def compress_file(path, window_bits):
+    """Writes path + '.zlib' and returns its name."""
+    packer = zlib.compressobj(9, zlib.DEFLATED, window_bits)
+    with open(path, "rb") as f:
+        data = packer.compress(f.read()) + packer.flush()
+    with open(path + ".zlib", "wb") as f:
+        f.write(data)
+    return path + ".zlib"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0],
+                                     epilog=__doc__.split("\n\n", 1)[1],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="main_dir tree, e.g. app")
+    parser.add_argument("output", help="directory for the release assets")
+    parser.add_argument("--name", help="asset name prefix (default: source directory name)")
+    compiler = parser.add_mutually_exclusive_group()
+    compiler.add_argument("--compiler", default="mpy-cross {src} -o {dst}",
+                          help="shell command template (default: %(default)s)")
+    compiler.add_argument("--compiler-module", help="module:function to call as compile(src, dst)")
+    parser.add_argument("--source-only", action="store_true", help="skip the compiled archive")
+    parser.add_argument("--compress", action="store_true", help="also write .tar.zlib archives (not for CircuitPython devices: they cannot inflate them)")
+    parser.add_argument("--key", default=os.getenv("OTA_MANIFEST_KEY"),
+                        help="sign the manifests with this shared secret (default: $OTA_MANIFEST_KEY)")
+    parser.add_argument("--window-bits", type=int, default=10, choices=range(9, 16),
+                        help="deflate window, 2**N bytes of device RAM (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    name = args.name or os.path.basename(os.path.normpath(args.source))
+    os.makedirs(args.output, exist_ok=True)
+    files = read_tree(args.source)
+    key = args.key.encode() if args.key else None
+
+    source_asset = os.path.join(args.output, name + ".tar")
+    write_bundle(source_asset, files, None, key)
+    print("%s: %d files" % (source_asset, len(files)))
+    with open(os.path.join(args.output, "manifest.json"), "wb") as f:
+        f.write(manifest_bytes(files, None))
+    if key:
+        with open(os.path.join(args.output, "manifest.json.sig"), "wb") as f:
+            f.write(sign(key, manifest_bytes(files, None)))
+        print("manifests signed")
+    assets = [source_asset]
+
+    if not args.source_only:
+        compile_file = (module_compiler(args.compiler_module) if args.compiler_module
+                        else command_compiler(args.compiler))
+        compiled, mpy = compile_tree(files, compile_file)
+        if mpy is None:
+            print("no .py files to compile")
+        else:
+            compiled_asset = os.path.join(args.output, "%s-mpy%d.tar" % (name, mpy))
+            write_bundle(compiled_asset, compiled, mpy, key)
+            print("%s: %d files, bytecode version %d" % (compiled_asset, len(compiled), mpy))
+            assets.append(compiled_asset)
+
+    if args.compress:
+        for asset in assets:
+            packed = compress_file(asset, args.window_bits)
+            print("%s: %d -> %d bytes" % (packed, os.path.getsize(asset), os.path.getsize(packed)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+"""
+Build binary patches from one release to the next, for OTAUpdater(patches_asset='patches.json').
+
+    python tools/make_patches.py v1.2 v1.3 dist/
+    python tools/make_patches.py v1.2 v1.3 dist/ --path app --src-dir src
+    python tools/make_patches.py v1.2 v1.3 dist/ --path lib --index patches-lib.json
+
+Compares main_dir (--path) at the two git tags and, for every file that
+changed, writes a patch that rebuilds the new file from the old one:
+
+    patches.json     index: for each file, the git blob SHA of the old file
+                     the patch applies to, the SHA and size of the result,
+                     and the patch asset name
+    p0001.patch ...  one patch per file
+
+Attach all of them to the new release. A device still running the old
+release downloads only the patch for each changed file and applies it
+to its installed copy as the patch streams in. A device whose copy is
+different (an older release, say) downloads the whole file as before.
+A patch is only kept when it is smaller than --max-ratio of the file.
+For OTAUpdater(components=..., patches_asset='patches-{}.json'), run it
+once per component with --path and --index patches-<name>.json; the
+patches are then named after the index, so the sets do not collide.
+
+Patch format: b'OTP1', then operations, then b'\\0':
+    0x01 <offset u32> <length u32>    copy length bytes of the old file from offset
+    0x02 <length u32> <bytes>         add these bytes
+(little endian). Copies are found by matching --block byte runs of the
+new file against an index of the old one, then extending each match.
+"""
+
+import argparse
+import json
+import os
+import struct
+import subprocess
+import sys
+
+from ota_common import git_blob_sha
+
+MAGIC = b"OTP1"
+END, COPY, ADD = 0, 1, 2
+INDEX = "patches.json"
+
+
+def make_patch(old, new, block=16):
+    """Greedy COPY/ADD encoding of new against old."""
+    index = {}
+    for i in range(len(old) - block + 1):
+        index.setdefault(old[i:i + block], i)
+    out = [MAGIC]
+    literal_start = 0
+    i = 0
+    min_copy = 2 * 9    # shorter copies cost more than adding the bytes
+    while i <= len(new) - block:
+        start = index.get(new[i:i + block])
+        if start is None:
+            i += 1
+            continue
+        found = i
+        length = block
+        while i + length < len(new) and start + length < len(old) and new[i + length] == old[start + length]:
+            length += 1
+        while i > literal_start and start > 0 and new[i - 1] == old[start - 1]:
+            i -= 1    # grow the match backwards into the pending literal
+            start -= 1
+            length += 1
+        if length < min_copy:
+            i = found + 1    # not from the backed up i: that finds the same match again
+            continue
+        if i > literal_start:
+            out.append(struct.pack("<BI", ADD, i - literal_start) + new[literal_start:i])
+        out.append(struct.pack("<BII", COPY, start, length))
+        i += length
+        literal_start = i
+    if literal_start < len(new):
+        out.append(struct.pack("<BI", ADD, len(new) - literal_start) + new[literal_start:])
+    out.append(bytes([END]))
+    return b"".join(out)
+
+
+def apply_patch(old, patch):
+    """Reference implementation of what the device does, used to check every patch."""
+    if patch[:4] != MAGIC:
+        raise ValueError("not a patch")
+    out = []
+    pos = 4
+    while True:
+        op = patch[pos]
+        pos += 1
+        if op == END:
+            return b"".join(out)
+        if op == COPY:
+            offset, length = struct.unpack_from("<II", patch, pos)
+            pos += 8
+            out.append(old[offset:offset + length])
+        elif op == ADD:
+            (length,) = struct.unpack_from("<I", patch, pos)
+            pos += 4
+            out.append(patch[pos:pos + length])
+            pos += length
+        else:
+            raise ValueError("bad operation %d" % op)
+
+
+def build_patches(old_files, new_files, from_tag, to_tag, max_ratio=0.5, block=16, prefix="p"):
+    """(index dict, {asset name: patch bytes}) for the files in both trees that changed."""
+    index = {"from": from_tag, "to": to_tag, "files": {}}
+    assets = {}
+    for path in sorted(new_files):
+        old, new = old_files.get(path), new_files[path]
+        if old is None or old == new:
+            continue
+        patch = make_patch(old, new, block)
+        if apply_patch(old, patch) != new:
+            raise AssertionError("patch for %s does not reproduce it" % path)
+        if len(patch) > max_ratio * len(new):
+            continue    # not worth it: the device downloads the file
+        name = "%s%04d.patch" % (prefix, len(assets) + 1)
+        assets[name] = patch
+        index["files"][path] = {"base": git_blob_sha(old), "sha": git_blob_sha(new),
+                                "size": len(new), "patch": name, "patch_size": len(patch)}
+    return index, assets
+
+
+def git_tree(tag, prefix):
+    """relative path -> bytes for the files below prefix at tag."""
+    listing = subprocess.run(["git", "ls-tree", "-r", "-z", tag, "--", prefix],
+                             check=True, capture_output=True).stdout
+    files = {}
+    for entry in listing.split(b"\0"):
+        if not entry:
+            continue
+        meta, path = entry.split(b"\t", 1)
+        (_, kind, sha) = meta.split()
+        if kind != b"blob":
+            continue
+        data = subprocess.run(["git", "cat-file", "blob", sha.decode()], check=True, capture_output=True).stdout
+        files[path.decode()[len(prefix):]] = data
+    return files
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0],
+                                     epilog=__doc__.split("\n\n", 1)[1],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("old", help="tag of the release devices are running")
+    parser.add_argument("new", help="tag of the release being published")
+    parser.add_argument("output", help="directory for the index and the patches")
+    parser.add_argument("--path", default="app", help="main_dir in the repository (default: %(default)s)")
+    parser.add_argument("--src-dir", default="", help="github_src_dir, if main_dir is not at the top")
+    parser.add_argument("--max-ratio", type=float, default=0.5,
+                        help="keep patches smaller than this fraction of the file (default: %(default)s)")
+    parser.add_argument("--block", type=int, default=16, help="match length searched for (default: %(default)s)")
+    parser.add_argument("--index", default=INDEX, help="name of the index, i.e. patches_asset (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    prefix = "/".join(p for p in (args.src_dir.strip("/"), args.path.strip("/")) if p) + "/"
+    index, assets = build_patches(git_tree(args.old, prefix), git_tree(args.new, prefix),
+                                  args.old, args.new, args.max_ratio, args.block,
+                                  "p" if args.index == INDEX else args.index.rsplit(".", 1)[0] + "-p")
+    os.makedirs(args.output, exist_ok=True)
+    for name, patch in assets.items():
+        with open(os.path.join(args.output, name), "wb") as f:
+            f.write(patch)
+    with open(os.path.join(args.output, args.index), "w") as f:
+        json.dump(index, f, separators=(",", ":"))
+    for path, entry in index["files"].items():
+        print("%s: %d -> %d bytes (%s)" % (path, entry["size"], entry["patch_size"], entry["patch"]))
+    print("%s: %d patches from %s to %s" % (os.path.join(args.output, args.index), len(assets), args.old, args.new))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,24 @@
+"""
+Helpers shared by the release tools (build_release.py, make_patches.py), the LAN
+mirror (ota_mirror.py) and the simulated GitHub in ota_sim/.
+"""
+
+import hashlib
+
+
+def git_blob_sha(data):
+    """The id git gives a file's content, as listed in trees and release manifests."""
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+def ranged(data, headers, extra=None):
+    """(status, headers, body) for data, honouring a "Range: bytes=<start>-" request."""
+    extra = dict(extra or {})
+    wanted = headers.get("Range", "")
+    if wanted.startswith("bytes="):
+        start = int(wanted[len("bytes="):].split("-")[0])
+        if start >= len(data):
+            return 416, extra, b""
+        extra["Content-Range"] = "bytes %d-%d/%d" % (start, len(data) - 1, len(data))
+        return 206, extra, data[start:]
+    return 200, extra, data
@@ -0,0 +1,289 @@
+"""
+LAN mirror of a repository's latest GitHub release, for OTAUpdater(sources=[...]).
+
+    python tools/ota_mirror.py owner/repo --cache /var/cache/ota --port 8080
+    python tools/ota_mirror.py owner/repo --path app --token ghp_xxx
+
+Downloads the latest release once (the git tree, every file below --path and
+the release assets) and serves it to the devices on the site:
+
+    /api/repos/<repo>/releases/latest          (ETag / If-None-Match)
+    /api/repos/<repo>/releases/tags/<tag>
+    /api/repos/<repo>/releases/assets/<tag>/<name>   (Range requests)
+    /api/repos/<repo>/contents/<path>?ref=refs/tags/<tag>
+    /api/repos/<repo>/git/trees/<tag>?recursive=1
+    /raw/<repo>/<tag>/<path>                   (Range requests)
+
+which is the layout OTAUpdater expects from a source given as a URL:
+
+    OTAUpdater(sources=['http://<this host>:8080', 'github'])
+
+Every --interval seconds the mirror asks GitHub whether there is a newer
+release. The question is conditional (If-None-Match), so an unchanged
+release costs no rate limit. Files whose git blob SHA is already in the
+cache are not downloaded again. Releases stay in the cache, so a device
+can still finish a download of the previous one.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from ota_common import git_blob_sha, ranged
+
+GITHUB_API = "https://api.github.com"
+GITHUB_RAW = "https://raw.githubusercontent.com"
+
+
+class Mirror:
+    """
+    The cache directory holds, per release tag, release.json and tree.json as GitHub
+    returned them, plus the files below path and the assets. Files are stored once
+    per blob SHA, so consecutive releases share the unchanged ones:
+
+        <cache>/latest                     tag of the latest release
+        <cache>/blobs/<sha>
+        <cache>/<tag>/release.json
+        <cache>/<tag>/tree.json
+        <cache>/<tag>/assets/<name>
+    """
+
+    def __init__(self, repo, cache, path="", token=None, api=GITHUB_API, raw=GITHUB_RAW):
+        self.repo = repo
+        self.cache = cache
+        self.path = path.strip("/")
+        self.api = api.rstrip("/")
+        self.raw = raw.rstrip("/")
+        self.headers = {"Accept": "application/vnd.github+json", "User-Agent": "ota-mirror"}
+        if token:
+            self.headers["Authorization"] = "token " + token
+        self.etag = None
+        self.lock = threading.Lock()
+        self.fetched = 0    # bytes downloaded from GitHub since start
+        os.makedirs(os.path.join(cache, "blobs"), exist_ok=True)
+
+    # -- syncing -------------------------------------------------------------------------
+
+    def _get(self, url, headers=None):
+        request = urllib.request.Request(url, headers=dict(self.headers, **(headers or {})))
+        with urllib.request.urlopen(request, timeout=60) as response:
+            body = response.read()
+            self.fetched += len(body)
+            return body, response.headers
+
+    def sync(self):
+        """Fetch the latest release if it changed; returns its tag."""
+        headers = {"If-None-Match": self.etag} if self.etag else {}
+        try:
+            body, response_headers = self._get("%s/repos/%s/releases/latest" % (self.api, self.repo), headers)
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return self.latest()
+            raise
+        release = json.loads(body)
+        tag = release["tag_name"]
+        if tag != self.latest():
+            self._fetch_release(tag, release)
+        self.etag = response_headers.get("ETag")
+        return tag
+
+    def _fetch_release(self, tag, release):
+        tag_dir = os.path.join(self.cache, tag)
+        os.makedirs(os.path.join(tag_dir, "assets"), exist_ok=True)
+        tree_body, _ = self._get("%s/repos/%s/git/trees/%s?recursive=1" % (self.api, self.repo, tag))
+        tree = json.loads(tree_body)
+        if tree.get("truncated"):
+            raise RuntimeError("git tree of %s is truncated" % tag)
+        files = 0
+        for item in tree["tree"]:
+            if item["type"] != "blob" or not self._wanted(item["path"]):
+                continue
+            blob = os.path.join(self.cache, "blobs", item["sha"])
+            if not os.path.exists(blob):
+                data, _ = self._get("%s/%s/%s/%s" % (self.raw, self.repo, tag, item["path"]))
+                if git_blob_sha(data) != item["sha"]:
+                    raise RuntimeError("%s at %s does not match its git SHA" % (item["path"], tag))
+                self._write(blob, data)
+                files += 1
+        for asset in release.get("assets", []):
+            data, _ = self._get(asset["url"], {"Accept": "application/octet-stream"})
+            self._write(os.path.join(tag_dir, "assets", asset["name"]), data)
+        self._write(os.path.join(tag_dir, "tree.json"), tree_body)
+        self._write(os.path.join(tag_dir, "release.json"), json.dumps(release).encode())
+        self._write(os.path.join(self.cache, "latest"), tag.encode())    # last: the release is complete
+        print("mirrored %s: %d new files, %d assets" % (tag, files, len(release.get("assets", []))))
+
+    def _wanted(self, path):
+        return not self.path or path == self.path or path.startswith(self.path + "/")
+
+    @staticmethod
+    def _write(path, data):
+        with open(path + ".new", "wb") as f:
+            f.write(data)
+        os.replace(path + ".new", path)
+
+    # -- serving -------------------------------------------------------------------------
+
+    def latest(self):
+        try:
+            with open(os.path.join(self.cache, "latest")) as f:
+                return f.read().strip()
+        except OSError:
+            return None
+
+    def _read(self, *parts):
+        try:
+            with open(os.path.join(self.cache, *parts), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _tree(self, tag):
+        body = self._read(tag, "tree.json")
+        return json.loads(body)["tree"] if body else None
+
+    def _release(self, tag, base_url):
+        body = self._read(tag, "release.json")
+        if body is None:
+            return None
+        release = json.loads(body)
+        for asset in release.get("assets", []):    # download them from here too
+            asset["url"] = asset["browser_download_url"] = "%s/api/repos/%s/releases/assets/%s/%s" % (
+                base_url, self.repo, tag, asset["name"])
+        return release
+
+    def handle(self, url, headers, base_url):
+        """Returns (status, headers dict, body bytes)."""
+        parts = urlsplit(url)
+        path = unquote(parts.path)
+        api = "/api/repos/" + self.repo + "/"
+        raw = "/raw/" + self.repo + "/"
+        if path.startswith(api):
+            return self.api_answer(path[len(api):], parse_qs(parts.query), headers, base_url)
+        if path.startswith(raw):
+            tag, _, file_path = path[len(raw):].partition("/")
+            return self.raw_answer(tag, file_path, headers)
+        return 404, {}, b"Not Found"
+
+    def api_answer(self, rest, query, headers, base_url):
+        not_found = (404, {}, b'{"message": "Not Found"}')
+        if rest == "releases/latest":
+            tag = self.latest()
+            if tag is None:
+                return not_found
+            etag = '"%s"' % hashlib.sha1(tag.encode()).hexdigest()
+            if headers.get("If-None-Match") == etag:
+                return 304, {"ETag": etag}, b""
+            return 200, {"ETag": etag}, json.dumps(self._release(tag, base_url)).encode()
+        if rest.startswith("releases/tags/"):
+            release = self._release(rest[len("releases/tags/"):], base_url)
+            return (200, {}, json.dumps(release).encode()) if release else not_found
+        if rest.startswith("releases/assets/"):
+            tag, _, name = rest[len("releases/assets/"):].partition("/")
+            data = self._read(tag, "assets", os.path.basename(name))
+            if data is None:
+                return not_found
+            return ranged(data, headers, {"Content-Type": "application/octet-stream"})
+        if rest.startswith("git/trees/"):
+            body = self._read(rest[len("git/trees/"):], "tree.json")
+            return (200, {}, body) if body else not_found
+        if rest.startswith("contents/"):
+            tag = query.get("ref", [""])[0].replace("refs/tags/", "")
+            tree = self._tree(tag)
+            if tree is None:
+                return not_found
+            directory = rest[len("contents/"):].strip("/")
+            listing = [{"name": item["path"].split("/")[-1], "path": item["path"],
+                        "type": "dir" if item["type"] == "tree" else "file",
+                        "sha": item["sha"], "size": item.get("size", 0)}
+                       for item in tree if item["path"].rpartition("/")[0] == directory]
+            return 200, {}, json.dumps(listing).encode()
+        return not_found
+
+    def raw_answer(self, tag, path, headers):
+        tree = self._tree(tag)
+        sha = next((item["sha"] for item in tree or [] if item["path"] == path and item["type"] == "blob"), None)
+        data = self._read("blobs", sha) if sha else None
+        if data is None:
+            return 404, {}, b"404: Not Found"
+        return ranged(data, headers)
+
+
+def make_handler(mirror):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"    # keep-alive: devices fetch many files in a row
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            self.respond(send_body=True)
+
+        def do_HEAD(self):
+            self.respond(send_body=False)
+
+        def respond(self, send_body):
+            base_url = "http://" + (self.headers.get("Host") or "%s:%d" % self.server.server_address)
+            status, headers, body = mirror.handle(self.path, self.headers, base_url)
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            if send_body:
+                self.wfile.write(body)
+
+    return Handler
+
+
+def sync_forever(mirror, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            mirror.sync()
+        except Exception as e:    # keep serving what we have
+            print("sync failed: %s" % e)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0],
+                                     epilog=__doc__.split("\n\n", 1)[1],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("repo", help="owner/repo")
+    parser.add_argument("--cache", default="ota_mirror_cache", help="directory for mirrored releases")
+    parser.add_argument("--path", default="", help="only mirror files below this repo path, e.g. app")
+    parser.add_argument("--token", default=os.getenv("GITHUB_TOKEN"),
+                        help="GitHub token for private repos (default: $GITHUB_TOKEN)")
+    parser.add_argument("--bind", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--interval", type=int, default=600, help="seconds between checks for a new release")
+    parser.add_argument("--api", default=GITHUB_API, help=argparse.SUPPRESS)    # for testing
+    parser.add_argument("--raw", default=GITHUB_RAW, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    mirror = Mirror(args.repo, args.cache, args.path, args.token, args.api, args.raw)
+    try:
+        print("latest release: %s" % mirror.sync())
+    except Exception as e:
+        if mirror.latest() is None:
+            print("cannot mirror %s: %s" % (args.repo, e))
+            return 1
+        print("sync failed, serving %s from the cache: %s" % (mirror.latest(), e))
+    threading.Thread(target=sync_forever, args=(mirror, args.interval), daemon=True).start()
+    server = ThreadingHTTPServer((args.bind, args.port), make_handler(mirror))
+    print("serving on http://%s:%d" % server.server_address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,274 @@
+"""
+Host-side benchmark for OTAUpdater: no board, no live GitHub.
+
+Runs install_update_if_available() end to end under CPython, with the stand-in
+CircuitPython modules in fakes/ and the local fake GitHub in server.py, against
+synthetic releases of different sizes and shapes. For each run it reports the
+HTTP requests and new connections made, body bytes transferred, wall time, peak
+Python heap (tracemalloc) and bytes written to the simulated flash. The fake
+GitHub runs in a child process, so the peak heap is the updater's (and the
+stand-in HTTP client's) alone.
+
+    python tools/ota_sim/bench.py
+    python tools/ota_sim/bench.py --shape large --latency 0.05 --bandwidth 250000
+    python tools/ota_sim/bench.py --mode tree+delta --loss 0.01 --changed 0.1
+    python tools/ota_sim/bench.py --shape deep --phases
+    python tools/ota_sim/bench.py --max-peak 120
+
+Every run also checks that the installed tree matches the release, that
+without --loss it kept one connection per host open for the whole run (a
+reconnect means a response was closed with its body unread), and, with
+--max-peak, that its peak heap stayed within that many KiB. A non-zero exit
+status means an update went wrong or used too many connections or too much
+memory.
+"""
+
+import argparse
+import builtins
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import zlib
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(os.path.dirname(HERE))
+sys.path.insert(0, os.path.join(HERE, "fakes"))
+sys.path.insert(0, HERE)
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(HERE))
+
+import adafruit_connection_manager              # noqa: E402,F401  (stand-ins in fakes/, loaded here so the
+import adafruit_requests                        # noqa: E402        first run's peak heap does not include them)
+import wifi                                     # noqa: E402,F401
+import build_release                            # noqa: E402
+import make_patches                             # noqa: E402
+from server import FakeGitHub, Release, serve_process   # noqa: E402
+
+"x.y".encode("idna")    # likewise the host's hostname codec, which the stand-in HTTP client loads
+
+REPO = "owner/repo"
+MAIN_DIR = "app"
+
+# name -> list of (path below main_dir, size in bytes)
+SHAPES = {
+    "small": [("mod%02d.py" % i, 2048) for i in range(30)] +
+             [("lib/lib%02d.py" % i, 1024) for i in range(10)],
+    "large": [("big%d.mpy" % i, 200 * 1024) for i in range(4)] + [("start.py", 1024)],
+    "deep":  [("/".join("d%d" % j for j in range(depth)) + "/f%d.py" % i, 1500)
+              for depth in range(1, 9) for i in range(3)],
+}
+
+# name -> OTAUpdater keyword arguments
+MODES = {
+    "contents":    {},
+    "tree":        {"listing": "tree"},
+    "tree+delta":  {"listing": "tree", "delta_update": True},
+    "bundle":      {"bundle_asset": "app.tar"},
+    "bundle.zlib": {"bundle_asset": "app.tar.zlib"},
+    "tree+gzip":   {"listing": "tree", "compressed": True},
+    "delta+patch": {"listing": "tree", "delta_update": True, "patches_asset": "patches.json"},
+}
+
+
+def make_files(shape, seed):
+    rand = random.Random(seed)
+    return {MAIN_DIR + "/" + path: bytes(rand.getrandbits(8) for _ in range(size))
+            for (path, size) in SHAPES[shape]}
+
+
+def change_files(files, fraction, seed):
+    rand = random.Random(seed)
+    changed = dict(files)
+    paths = sorted(files)
+    for path in rand.sample(paths, max(1, int(len(paths) * fraction))):
+        data = bytearray(changed[path])
+        data[rand.randrange(len(data))] ^= 0xFF
+        changed[path] = bytes(data)
+    return changed
+
+
+def make_bundle(files):    # as tools/build_release.py builds it, manifest included
+    with tempfile.TemporaryDirectory() as work:
+        path = os.path.join(work, "app.tar")
+        build_release.write_bundle(path, {p[len(MAIN_DIR) + 1:]: data for p, data in files.items()}, None)
+        with open(path, "rb") as f:
+            return f.read()
+
+
+def bundle_assets(files):
+    bundle = make_bundle(files)
+    packer = zlib.compressobj(9, zlib.DEFLATED, 10)    # the window build_release.py uses
+    return {"app.tar": bundle, "app.tar.zlib": packer.compress(bundle) + packer.flush()}
+
+
+def patch_assets(old, new):    # patches.json and the patches, as tools/make_patches.py writes them
+    strip = len(MAIN_DIR) + 1
+    index, assets = make_patches.build_patches({p[strip:]: d for p, d in old.items()},
+                                               {p[strip:]: d for p, d in new.items()}, "v1", "v2")
+    assets[make_patches.INDEX] = json.dumps(index).encode()
+    return assets
+
+
+class FlashMeter:
+    """Counts bytes written through open() while installed, standing in for flash wear."""
+
+    def __init__(self):
+        self.written = 0
+        self._open = builtins.open
+
+    def __enter__(self):
+        meter = self
+        real_open = self._open
+
+        class Counted(io.RawIOBase):
+            def __init__(self, f):
+                self.f = f
+
+            def write(self, data):
+                meter.written += len(data.encode() if isinstance(data, str) else memoryview(data))
+                return self.f.write(data)
+
+            def close(self):
+                self.f.close()
+
+            def __getattr__(self, name):
+                return getattr(self.f, name)
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *args):
+                self.close()
+
+        def counting_open(file, mode="r", *args, **kw):
+            f = real_open(file, mode, *args, **kw)
+            return Counted(f) if any(c in mode for c in "wax+") else f
+
+        builtins.open = counting_open
+        return self
+
+    def __exit__(self, *args):
+        builtins.open = self._open
+
+
+def read_tree(root):
+    out = {}
+    for dirpath, _, names in os.walk(root):
+        for name in names:
+            path = os.path.join(dirpath, name)
+            with open(path, "rb") as f:
+                out[os.path.relpath(path, root).replace(os.sep, "/")] = f.read()
+    return out
+
+
+def run_update(shape="small", mode="tree", changed=0.1, latency=0.0, bandwidth=0, loss=0.0,
+               seed=1, updater_args=None):
+    """Install v2 over v1 in a scratch directory; returns a dict of measurements."""
+    from app.ota_updater import OTAUpdater
+
+    old = make_files(shape, seed)
+    new = change_files(old, changed, seed + 1)
+    github = FakeGitHub(REPO, latency=latency, bandwidth=bandwidth, loss=loss, seed=seed)
+    github.add_release(Release("v1", old, bundle_assets(old)), latest=False)
+    github.add_release(Release("v2", new, dict(bundle_assets(new), **patch_assets(old, new))))
+    server, base_url = serve_process(github)
+    adafruit_requests.BASE_URL = base_url
+    adafruit_requests.reset_stats()
+
+    cwd = os.getcwd()
+    scratch = tempfile.mkdtemp(prefix="ota_sim_")
+    try:
+        os.chdir(scratch)
+        for path, data in old.items():
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(data)
+        with open(MAIN_DIR + "/.version", "w") as f:
+            f.write("v1")
+
+        kwargs = dict(MODES[mode])
+        kwargs.update(updater_args or {})
+        stdout = sys.stdout
+        tracemalloc.start()
+        started = time.monotonic()
+        try:
+            with FlashMeter() as flash:
+                sys.stdout = io.StringIO()    # the updater is chatty
+                updater = OTAUpdater(github_repo=REPO, main_dir=MAIN_DIR, secrets_file=None, **kwargs)
+                attempts = 0
+                installed = False
+                while not installed and attempts < 5:    # a device would retry on the next boot
+                    attempts += 1
+                    installed = updater.install_update_if_available()
+        finally:
+            sys.stdout = stdout
+            elapsed = time.monotonic() - started
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        result = read_tree(MAIN_DIR)
+        result.pop(build_release.MANIFEST, None)    # installed along with bundles
+        expected = {path[len(MAIN_DIR) + 1:]: data for path, data in new.items()}
+        expected[".version"] = b"v2"
+        return {
+            "shape": shape, "mode": mode, "ok": installed and result == expected,
+            "attempts": attempts,
+            "requests": adafruit_requests.stats["requests"],
+            "connections": adafruit_requests.stats["connections"],
+            "reconnects": adafruit_requests.stats["reconnects"],
+            "bytes": adafruit_requests.stats["bytes"],
+            "seconds": elapsed, "peak": peak, "flash": flash.written,
+            "phases": dict(updater.metrics),
+        }
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(scratch, ignore_errors=True)
+        server.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shape", choices=sorted(SHAPES) + ["all"], default="all")
+    parser.add_argument("--mode", choices=sorted(MODES) + ["all"], default="all")
+    parser.add_argument("--changed", type=float, default=0.1, help="fraction of files changed in v2")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--bandwidth", type=int, default=0, help="bytes/second, 0 for unlimited")
+    parser.add_argument("--loss", type=float, default=0.0, help="chance of a dropped connection per KiB")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--phases", action="store_true", help="also show the updater's per-phase metrics")
+    parser.add_argument("--max-peak", type=float, default=0, help="KiB of peak heap a run may use, 0 for no limit")
+    args = parser.parse_args(argv)
+
+    shapes = sorted(SHAPES) if args.shape == "all" else [args.shape]
+    modes = list(MODES) if args.mode == "all" else [args.mode]
+    header = "%-6s %-11s %-4s %3s %5s %5s %9s %8s %9s  %9s" % (
+        "shape", "mode", "ok", "try", "reqs", "conns", "net KiB", "wall s", "peak KiB", "flash KiB")
+    print(header)
+    print("-" * len(header))
+    failed = 0
+    for shape in shapes:
+        for mode in modes:
+            r = run_update(shape, mode, args.changed, args.latency, args.bandwidth, args.loss, args.seed)
+            too_big = args.max_peak and r["peak"] > args.max_peak * 1024
+            reconnected = not args.loss and r["reconnects"]
+            failed += not r["ok"] or too_big or reconnected
+            print("%-6s %-11s %-4s %3d %5d %5d%s %8.1f %8.2f %9.1f%s %9.1f" % (
+                r["shape"], r["mode"], "yes" if r["ok"] else "NO", r["attempts"], r["requests"],
+                r["connections"], "!" if reconnected else " ", r["bytes"] / 1024, r["seconds"],
+                r["peak"] / 1024, "!" if too_big else " ", r["flash"] / 1024))
+            if args.phases:
+                for name, m in r["phases"].items():
+                    print("    %-9s x%-3d %7d ms %9.1f KiB %4d reqs" % (
+                        name, m["count"], m["ms"], m["bytes"] / 1024, m["requests"]))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
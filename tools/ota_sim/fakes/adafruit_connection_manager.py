@@ -0,0 +1,27 @@
+"""Host stand-in for adafruit_connection_manager."""
+
+import adafruit_requests
+
+
+class _SocketPool:
+    SOCK_STREAM = 1
+
+    def getaddrinfo(self, host, port, family=0, type=0, proto=0, flags=0):
+        return [(2, 1, 0, "", ("127.0.0.1", port))]
+
+
+_pool = _SocketPool()
+
+
+def get_radio_socketpool(radio):
+    return _pool
+
+
+def get_radio_ssl_context(radio):
+    return object()
+
+
+def connection_manager_close_all(socket_pool=None, release_references=False):
+    for session in adafruit_requests._sessions:
+        if socket_pool is None or session._socket_pool is socket_pool:
+            session.close_all()
@@ -0,0 +1,151 @@
+"""
+Host stand-in for adafruit_requests, built on http.client.
+
+Requests for https://api.github.com and https://raw.githubusercontent.com are sent to
+the local fake GitHub at BASE_URL (see server.py). Like the real library, one
+connection is kept open per host and reused until it fails or the pool is closed,
+and the socket pool is asked for an address only when a new connection is made.
+Also like the real library (4.x), closing a response does not read the rest of its
+body: the next request to that host finds it where its status line should be, so
+drops the socket and connects again.
+"""
+
+import http.client
+import json as json_module
+from urllib.parse import urlsplit
+
+BASE_URL = None    # e.g. 'http://127.0.0.1:8080', set by the harness
+HOST_PREFIXES = {
+    "api.github.com": "/api",
+    "raw.githubusercontent.com": "/raw",
+}
+
+stats = {"requests": 0, "connections": 0, "reconnects": 0, "bytes": 0}
+_sessions = []
+_connected = set()    # hosts connected to since reset_stats(); another connection is a reconnect
+
+
+def reset_stats():
+    for key in stats:
+        stats[key] = 0
+    _connected.clear()
+
+
+class Response:
+    def __init__(self, session, host, response):
+        self._session = session
+        self._host = host
+        self._response = response
+        self.status_code = response.status
+        self.reason = response.reason
+        self.headers = {name.lower(): value for name, value in response.getheaders()}
+        self._cached = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _read(self, size=-1):
+        try:
+            data = self._response.read(size) if size >= 0 else self._response.read()
+        except (http.client.HTTPException, OSError) as e:
+            self._session._drop(self._host)
+            raise OSError(104, "connection lost: {}".format(e))
+        stats["bytes"] += len(data)
+        return data
+
+    def iter_content(self, chunk_size=1, decode_unicode=False):
+        while True:
+            data = self._read(chunk_size)
+            if not data:
+                if self._response.length:    # server hung up before the body was complete
+                    self._session._drop(self._host)
+                    raise OSError(104, "connection lost")
+                return
+            yield data
+
+    @property
+    def content(self):
+        if self._cached is None:
+            self._cached = self._read()
+        return self._cached
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8")
+
+    def json(self):
+        return json_module.loads(self.content)
+
+    def close(self):
+        if self._response is None:
+            return
+        if self._response.length == 0:
+            self._response.read()    # no body (a 304, say): http.client wants it marked read
+        elif not self._response.isclosed():
+            self._session._unread.add(self._host)    # body left on the socket
+        self._response = None
+
+
+class Session:
+    def __init__(self, socket_pool, ssl_context=None, session_id=None):
+        self._socket_pool = socket_pool
+        self._connections = {}
+        self._unread = set()    # hosts whose socket still holds the body of a closed response
+        _sessions.append(self)
+
+    def _target(self, url):
+        parts = urlsplit(url)
+        base = urlsplit(BASE_URL)
+        prefix = HOST_PREFIXES.get(parts.hostname)
+        if prefix is None:    # anything else (a LAN mirror, say) is served as-is
+            return parts.netloc, parts.hostname, parts.port or 80, (parts.path or "/") + ("?" + parts.query if parts.query else "")
+        path = prefix + parts.path + ("?" + parts.query if parts.query else "")
+        return parts.netloc, base.hostname, base.port, path
+
+    def _connection(self, key, host, port):
+        connection = self._connections.get(key)
+        if connection is None:
+            self._socket_pool.getaddrinfo(key.split(":")[0], 443, 0, 1)
+            connection = http.client.HTTPConnection(host, port, timeout=30)
+            self._connections[key] = connection
+            stats["connections"] += 1
+            if key in _connected:
+                stats["reconnects"] += 1
+            _connected.add(key)
+        return connection
+
+    def _drop(self, key):
+        self._unread.discard(key)
+        connection = self._connections.pop(key, None)
+        if connection is not None:
+            connection.close()
+
+    def close_all(self):
+        for key in list(self._connections):
+            self._drop(key)
+
+    def request(self, method, url, data=None, json=None, headers=None, stream=False, timeout=60):
+        key, host, port, path = self._target(url)
+        stats["requests"] += 1
+        if key in self._unread:
+            self._drop(key)    # would read the old body instead of "HTTP/1.1"
+        for attempt in (1, 2):    # a kept-alive socket may have been closed by the server
+            connection = self._connection(key, host, port)
+            try:
+                connection.request(method, path, body=data, headers=dict(headers or {}))
+                response = connection.getresponse()
+                break
+            except (http.client.HTTPException, OSError) as e:
+                self._drop(key)
+                if attempt == 2:
+                    raise OSError(104, "request failed: {}".format(e))
+        return Response(self, key, response)
+
+    def get(self, url, **kw):
+        return self.request("GET", url, **kw)
+
+    def head(self, url, **kw):
+        return self.request("HEAD", url, **kw)
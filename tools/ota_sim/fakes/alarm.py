@@ -0,0 +1,32 @@
+"""Host stand-in for the CircuitPython alarm module: deep sleep ends the program."""
+
+
+class _TimeModule:
+    class TimeAlarm:
+        def __init__(self, *, monotonic_time=None, epoch_time=None):
+            self.monotonic_time = monotonic_time
+            self.epoch_time = epoch_time
+
+
+class _PinModule:
+    class PinAlarm:
+        def __init__(self, pin, value, edge=False, pull=False):
+            self.pin = pin
+            self.value = value
+
+
+time = _TimeModule
+pin = _PinModule
+sleep_memory = bytearray(4096)    # kept across simulated deep sleeps, as on the board
+wake_alarm = None
+slept_with = None                 # the alarms of the last exit_and_deep_sleep_until_alarms()
+
+
+class DeepSleep(SystemExit):
+    pass
+
+
+def exit_and_deep_sleep_until_alarms(*alarms, preserve_dios=()):
+    global slept_with
+    slept_with = alarms
+    raise DeepSleep()
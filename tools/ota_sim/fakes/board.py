@@ -0,0 +1,5 @@
+"""Host stand-in for the CircuitPython board module (Adafruit ESP32-S3 Reverse TFT pins)."""
+
+D0 = "D0"
+D1 = "D1"
+D2 = "D2"
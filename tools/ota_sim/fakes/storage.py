@@ -0,0 +1,5 @@
+"""Host stand-in for the CircuitPython storage module."""
+
+
+def remount(mount_path, readonly=False, *, disable_concurrent_write_protection=False):
+    pass
@@ -0,0 +1,32 @@
+"""Host stand-in for the CircuitPython wifi module: always associated."""
+
+
+class Network:
+    def __init__(self, ssid, bssid, channel, rssi):
+        self.ssid = ssid
+        self.bssid = bssid
+        self.channel = channel
+        self.rssi = rssi
+
+
+class Radio:
+    def __init__(self):
+        self.enabled = True
+        self.connected = True
+        self.ipv4_address = "127.0.0.1"
+        self.ap_info = Network("SIM", b"\x02\x00\x00\x00\x00\x01", 6, -50)
+        self.connects = 0
+
+    def connect(self, ssid, password=None, *, channel=0, bssid=None, timeout=None):
+        self.connects += 1
+        self.connected = True
+        self.ap_info = Network(ssid, bssid or self.ap_info.bssid, channel or self.ap_info.channel, -50)
+
+    def start_scanning_networks(self, *, start_channel=1, stop_channel=11):
+        return iter([self.ap_info])
+
+    def stop_scanning_networks(self):
+        pass
+
+
+radio = Radio()
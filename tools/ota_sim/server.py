@@ -0,0 +1,256 @@
+"""
+Local stand-in for the parts of GitHub that OTAUpdater talks to.
+
+Serves, for one repository:
+    /api/repos/<repo>/releases/latest          (ETag / If-None-Match, X-RateLimit-* headers)
+    /api/repos/<repo>/releases/tags/<tag>      (release JSON with assets)
+    /api/repos/<repo>/releases/assets/<tag>/<name>   (Range requests)
+    /api/repos/<repo>/contents/<path>?ref=refs/tags/<tag>
+    /api/repos/<repo>/git/trees/<tag>?recursive=1
+    /raw/<repo>/<tag>/<path>                   (Range requests, gzip when accepted)
+
+The fake adafruit_requests in fakes/ maps https://api.github.com and
+https://raw.githubusercontent.com onto /api and /raw of this server.
+Latency, bandwidth and packet loss are applied to every response.
+"""
+
+import gzip
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))    # tools/
+from ota_common import git_blob_sha, ranged  # noqa: E402
+
+
+class Release:
+    """One tagged release: a dict of repo path -> bytes, plus named assets."""
+
+    def __init__(self, tag, files, assets=None):
+        self.tag = tag
+        self.files = dict(files)
+        self.assets = dict(assets or {})
+
+    def tree(self):
+        entries = []
+        dirs = set()
+        for path in sorted(self.files):
+            parts = path.split("/")
+            for i in range(1, len(parts)):
+                d = "/".join(parts[:i])
+                if d not in dirs:
+                    dirs.add(d)
+                    entries.append({"path": d, "mode": "040000", "type": "tree",
+                                    "sha": self.dir_sha(d)})
+            data = self.files[path]
+            entries.append({"path": path, "mode": "100644", "type": "blob",
+                            "sha": git_blob_sha(data), "size": len(data)})
+        return entries
+
+    def dir_sha(self, directory):
+        h = hashlib.sha1()
+        for path in sorted(self.files):
+            if path.startswith(directory + "/"):
+                h.update(path.encode() + b"\0" + git_blob_sha(self.files[path]).encode())
+        return h.hexdigest()
+
+    def contents(self, directory):
+        out = {}
+        prefix = directory + "/" if directory else ""    # "" is the top of the repo
+        for path, data in self.files.items():
+            if not path.startswith(prefix):
+                continue
+            rest = path[len(prefix):]
+            name = rest.split("/")[0]
+            if "/" in rest:
+                out[name] = {"name": name, "path": prefix + name, "type": "dir",
+                             "sha": self.dir_sha(prefix + name), "size": 0}
+            else:
+                out[name] = {"name": name, "path": path, "type": "file",
+                             "sha": git_blob_sha(data), "size": len(data)}
+        return list(out.values())
+
+
+class FakeGitHub:
+    """Release store plus network conditions shared by all request handlers."""
+
+    def __init__(self, repo="owner/repo", latency=0.0, bandwidth=0, loss=0.0, seed=1,
+                 rate_limit=5000):
+        self.repo = repo
+        self.releases = {}
+        self.latest = None
+        self.latency = latency          # seconds added before every response
+        self.bandwidth = bandwidth      # bytes/second for bodies, 0 = unlimited
+        self.loss = loss                # chance per 1 KiB body block that the connection drops
+        self.random = random.Random(seed)
+        self.rate_limit = rate_limit
+        self.rate_remaining = rate_limit
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def __getstate__(self):    # for serve_process(): a lock cannot be pickled
+        state = dict(self.__dict__)
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def add_release(self, release, latest=True):
+        self.releases[release.tag] = release
+        if latest:
+            self.latest = release.tag
+
+    # -- routing -------------------------------------------------------------------------
+
+    def handle(self, method, url, headers):
+        """Returns (status, headers dict, body bytes, counts_against_rate_limit)."""
+        parts = urlsplit(url)
+        query = parse_qs(parts.query)
+        path = parts.path
+        api = "/api/repos/" + self.repo + "/"
+        raw = "/raw/" + self.repo + "/"
+        if path.startswith(api):
+            return self.api(path[len(api):], query, headers)
+        if path.startswith(raw):
+            tag, _, file_path = path[len(raw):].partition("/")
+            return self.raw(tag, file_path, headers)
+        return 404, {}, b"Not Found", False
+
+    def api(self, rest, query, headers):
+        if rest == "releases/latest":
+            etag = 'W/"%s"' % hashlib.sha1(self.latest.encode()).hexdigest()
+            if headers.get("If-None-Match") == etag:
+                return 304, {"ETag": etag}, b"", False
+            body = {"tag_name": self.latest, "name": self.latest, "body": "release notes " * 200,
+                    "assets": self.asset_json(self.latest)}
+            return 200, {"ETag": etag}, json.dumps(body).encode(), True
+        if rest.startswith("releases/tags/"):
+            tag = rest[len("releases/tags/"):]
+            if tag not in self.releases:
+                return 404, {}, b'{"message": "Not Found"}', True
+            body = {"tag_name": tag, "assets": self.asset_json(tag)}
+            return 200, {}, json.dumps(body).encode(), True
+        if rest.startswith("releases/assets/"):
+            tag, _, name = rest[len("releases/assets/"):].partition("/")
+            data = self.releases.get(tag) and self.releases[tag].assets.get(name)
+            if data is None:
+                return 404, {}, b"Not Found", True
+            return ranged(data, headers, {"Content-Type": "application/octet-stream"}) + (True,)
+        if rest.startswith("contents/"):
+            tag = query.get("ref", [""])[0].replace("refs/tags/", "")
+            release = self.releases.get(tag)
+            if release is None:
+                return 404, {}, b'{"message": "No commit found"}', True
+            return 200, {}, json.dumps(release.contents(rest[len("contents/"):].strip("/"))).encode(), True
+        if rest.startswith("git/trees/"):
+            release = self.releases.get(rest[len("git/trees/"):])
+            if release is None:
+                return 404, {}, b'{"message": "Not Found"}', True
+            return 200, {}, json.dumps({"sha": "0" * 40, "tree": release.tree(), "truncated": False}).encode(), True
+        return 404, {}, b'{"message": "Not Found"}', True
+
+    def asset_json(self, tag):
+        return [{"name": name, "size": len(data),
+                 "url": "https://api.github.com/repos/%s/releases/assets/%s/%s" % (self.repo, tag, name),
+                 "browser_download_url": "https://github.com/%s/releases/download/%s/%s" % (self.repo, tag, name)}
+                for name, data in self.releases[tag].assets.items()]
+
+    def raw(self, tag, path, headers):
+        release = self.releases.get(tag)
+        data = release and release.files.get(path)
+        if data is None:
+            return 404, {}, b"404: Not Found", False
+        if "gzip" in headers.get("Accept-Encoding", "") and "Range" not in headers:
+            return 200, {"Content-Encoding": "gzip"}, gzip.compress(data, mtime=0), False
+        return ranged(data, headers) + (False,)
+
+
+def make_handler(github):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"    # keep-alive, like GitHub
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            self.respond(send_body=True)
+
+        def do_HEAD(self):
+            self.respond(send_body=False)
+
+        def respond(self, send_body):
+            with github.lock:
+                github.requests += 1
+                status, headers, body, counted = github.handle(self.command, self.path, self.headers)
+                if counted:
+                    github.rate_remaining = max(github.rate_remaining - 1, 0)
+                remaining = github.rate_remaining
+            if github.latency:
+                time.sleep(github.latency)
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("X-RateLimit-Limit", str(github.rate_limit))
+            self.send_header("X-RateLimit-Remaining", str(remaining))
+            self.send_header("X-RateLimit-Reset", str(int(time.time()) + 3600))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            if not send_body:
+                return
+            block = 1024
+            for i in range(0, len(body), block):
+                if github.loss and github.random.random() < github.loss:
+                    self.close_connection = True    # connection lost mid-body
+                    return
+                self.wfile.write(body[i:i + block])
+                if github.bandwidth:
+                    time.sleep(block / github.bandwidth)
+
+    return Handler
+
+
+def serve(github, port=0):
+    """Start a background server; returns (server, base_url)."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(github))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://127.0.0.1:%d" % server.server_address[1]
+
+
+class ServerProcess:
+    """serve() in a child process, so what this process allocates is the client's alone."""
+
+    def __init__(self, github, port=0):
+        parent, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_serve_forever, args=(github, port, child), daemon=True)
+        self.process.start()
+        self.base_url = parent.recv()
+        parent.close()
+
+    def close(self):
+        self.process.terminate()
+        self.process.join()
+
+
+def _serve_forever(github, port, conn):
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(github))
+    server.daemon_threads = True
+    conn.send("http://127.0.0.1:%d" % server.server_address[1])
+    conn.close()
+    server.serve_forever()
+
+
+def serve_process(github, port=0):
+    """Start the server in a child process; returns (ServerProcess, base_url)."""
+    process = ServerProcess(github, port)
+    return process, process.base_url